@@ -0,0 +1,71 @@
+"""Compare per-row and batched notification fan-out throughput.
+
+Run from the "backend" folder while development services are up:
+`python -m benchmark.notifications_fanout`"""
+import asyncio
+import time
+from uuid import uuid4
+
+from sqlalchemy import insert, delete
+
+from auth.models import profile
+from common import injection
+from common.injection import injector
+from database.core import db
+from notification.models import Notification, NotificationData, \
+    notification_event
+from notification.repo import NotificationRepo
+
+RECIPIENTS = 50
+EVENTS = 40
+
+
+async def create_profiles(count: int):
+    uids = [str(uuid4())[:32] for _ in range(count)]
+    rows = await db.fetch_all(
+        insert(profile)
+            .values([dict(username=uid,
+                          email=f"{uid}@bunnybook.com",
+                          password=uid) for uid in uids])
+            .returning(profile.c.id))
+    return [row["id"] for row in rows]
+
+
+def new_notifications(recipients):
+    return [Notification(profile_id=recipient,
+                         data=NotificationData(event="BENCHMARK",
+                                               payload={"n": n}))
+            for n in range(EVENTS) for recipient in recipients]
+
+
+async def main():
+    await injection.configure()
+    await db.connect()
+    repo = injector.get(NotificationRepo)
+    recipients = await create_profiles(RECIPIENTS)
+    try:
+        notifications = new_notifications(recipients)
+        start = time.perf_counter()
+        for notification in notifications:
+            await repo.save_notification(notification)
+        per_row = len(notifications) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for n in range(EVENTS):
+            await repo.save_notifications(
+                notifications[n * RECIPIENTS:(n + 1) * RECIPIENTS])
+        batched = len(notifications) / (time.perf_counter() - start)
+
+        print(f"per-row inserts: {per_row:.0f} notifications/s")
+        print(f"batched inserts: {batched:.0f} notifications/s "
+              f"({batched / per_row:.1f}x)")
+    finally:
+        await db.execute(delete(profile).where(profile.c.id.in_(recipients)))
+        # events are shared by recipients, so they outlive their notifications
+        await db.execute(delete(notification_event).where(
+            notification_event.c.data["event"].astext == "BENCHMARK"))
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
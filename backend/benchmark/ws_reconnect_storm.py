@@ -0,0 +1,67 @@
+"""Measure WebSocket connects per second during a reconnect storm, i.e. many
+clients connecting at once (as after a deploy or a network blip).
+
+Run from the "backend" folder while development services and the backend
+(`python main.py`) are up: `python -m benchmark.ws_reconnect_storm`"""
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import requests
+import socketio
+
+BACKEND_URL = "http://localhost:8000"
+USERS = 20
+CONNECTIONS = 500
+CONCURRENCY = 100
+
+
+def create_user():
+    uid = str(uuid4())[:32]
+    credentials = dict(email=f"{uid}@bunnybook.com", password=uid)
+    requests.post(f"{BACKEND_URL}/web/register",
+                  json=dict(username=uid, **credentials)).raise_for_status()
+    response = requests.post(f"{BACKEND_URL}/web/login", json=credentials)
+    response.raise_for_status()
+    return response.json()["accessToken"], response.cookies["refresh_token"]
+
+
+def connect(user) -> float:
+    # time from connection attempt to bootstrap payload reception
+    access_token, refresh_token = user
+    bootstrapped = threading.Event()
+    client = socketio.Client(reconnection=False)
+    client.on("bootstrap", lambda events: bootstrapped.set())
+    start = time.perf_counter()
+    client.connect(BACKEND_URL,
+                   socketio_path="/ws/socket.io",
+                   transports=["websocket"],
+                   headers={"Cookie": f"refresh_token={refresh_token}"},
+                   auth={"token": access_token})
+    try:
+        if not bootstrapped.wait(timeout=10):
+            raise TimeoutError("Bootstrap payload not received")
+        return time.perf_counter() - start
+    finally:
+        client.disconnect()
+
+
+def main():
+    users = [create_user() for _ in range(USERS)]
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        start = time.perf_counter()
+        latencies = sorted(executor.map(
+            connect, [users[n % USERS] for n in range(CONNECTIONS)]))
+        elapsed = time.perf_counter() - start
+    print(f"{CONNECTIONS} connects ({CONCURRENCY} concurrent): "
+          f"{CONNECTIONS / elapsed:.0f} connects/s")
+    print(f"connect to bootstrap latency: "
+          f"p50 {statistics.median(latencies) * 1000:.0f} ms, "
+          f"p95 {latencies[int(0.95 * (len(latencies) - 1))] * 1000:.0f} ms, "
+          f"max {latencies[-1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,9 @@ from fastapi_utils.inferring_router import InferringRouter
 from starlette import status
 
 from auth.models import User
-from auth.security import get_user
-from chat.schemas import ChatMessageRead, ConversationRead
+from auth.security import get_user, get_admin
+from chat.schemas import ChatMessageRead, ConversationRead, \
+    ChatMessageMetricsRead
 from chat.service import ChatService
 from common.injection import on
 from common.rate_limiter import RateLimitTo
@@ -32,8 +33,8 @@ class ChatApi:
             limit: Optional[int] = Query(20, ge=1, le=20),
             user: User = Depends(get_user)):
         """Get messages belonging to a specific chat group."""
-        if user.id not in await self._service.get_chat_group_members_profile_ids(
-                chat_group_id):
+        if not await self._service.is_chat_group_member(user.id,
+                                                        chat_group_id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
         return await self._service.get_conversation_messages(
             chat_group_id, older_than=older_than, limit=limit)
@@ -54,3 +55,13 @@ class ChatApi:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
         return await self._service.get_conversations(
             profile_id, older_than=older_than, limit=limit)
+
+    @chat_router.get(
+        "/chat/metrics",
+        response_model=ChatMessageMetricsRead)
+    async def get_chat_metrics(
+            self,
+            admin: User = Depends(get_admin)):
+        """Get sent messages, send-to-deliver latency and typing events
+        forwarded or dropped by throttling."""
+        return self._service.metrics()
@@ -0,0 +1,147 @@
+import datetime as dt
+import json
+from typing import List, Optional, Dict
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+from injector import singleton, inject
+
+from chat.models import ChatMessage
+from common.cache import fail_silently
+from common.injection import Cache
+from database.utils import map_to
+
+
+@singleton
+class ChatCache:
+    # latest messages of each chat group are kept in a sorted set by creation
+    # date, filled from PostgreSQL on first read and then appended on write
+    MESSAGES_COUNT: int = 50
+    MESSAGES_EX: int = int(dt.timedelta(hours=1).total_seconds())
+    # append only to already filled buffers, which must not miss messages;
+    # otherwise flag the buffer as stale, so that a concurrent fill which read
+    # from PostgreSQL before this message was committed is discarded
+    ADD_MESSAGE_SCRIPT: str = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+        redis.call('EXPIRE', KEYS[1], ARGV[4])
+    else
+        redis.call('SET', KEYS[2], 1, 'EX', ARGV[5])
+    end
+    return nil"""
+    SET_MESSAGES_SCRIPT: str = """
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        return 0
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('ZADD', KEYS[1], unpack(ARGV, 2))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 1"""
+    STALE_EX: int = 10
+    MEMBERS_EX: int = int(dt.timedelta(minutes=10).total_seconds())
+
+    @inject
+    def __init__(self, cache: Cache):
+        self._cache = cache
+
+    @fail_silently()
+    async def get_messages(
+            self,
+            chat_group_id: UUID,
+            older_than: dt.datetime,
+            limit: int) -> Optional[List[ChatMessage]]:
+        pipe = self._cache.pipeline()
+        messages = pipe.zrevrangebyscore(
+            f"chat_groups:{chat_group_id}:messages",
+            max=older_than.timestamp(),
+            exclude=self._cache.ZSET_EXCLUDE_MAX,
+            offset=0,
+            count=limit)
+        size = pipe.zcard(f"chat_groups:{chat_group_id}:messages")
+        await pipe.execute()
+        messages, size = await messages, await size
+        # a partial page can be served only if the buffer was never trimmed,
+        # that is if it holds the whole chat history
+        if not size or (len(messages) < limit
+                        and size >= ChatCache.MESSAGES_COUNT):
+            return None
+        return [map_to(json.loads(message), ChatMessage)
+                for message in messages]
+
+    @fail_silently()
+    async def set_messages(
+            self,
+            chat_group_id: UUID,
+            messages: List[ChatMessage]) -> None:
+        messages = messages[:ChatCache.MESSAGES_COUNT]
+        if not messages:
+            return
+        await self._cache.eval(
+            ChatCache.SET_MESSAGES_SCRIPT,
+            keys=[f"chat_groups:{chat_group_id}:messages",
+                  f"chat_groups:{chat_group_id}:messages:stale"],
+            args=[ChatCache.MESSAGES_EX,
+                  *[item for message in messages
+                    for item in (message.created_at.timestamp(),
+                                 json.dumps(jsonable_encoder(message)))]])
+
+    @fail_silently()
+    async def add_message(self, message: ChatMessage) -> None:
+        await self._cache.eval(
+            ChatCache.ADD_MESSAGE_SCRIPT,
+            keys=[f"chat_groups:{message.chat_group_id}:messages",
+                  f"chat_groups:{message.chat_group_id}:messages:stale"],
+            args=[message.created_at.timestamp(),
+                  json.dumps(jsonable_encoder(message)),
+                  ChatCache.MESSAGES_COUNT,
+                  ChatCache.MESSAGES_EX,
+                  ChatCache.STALE_EX])
+
+    @fail_silently()
+    async def unset_messages(self, chat_group_id: UUID) -> None:
+        await self._cache.delete(f"chat_groups:{chat_group_id}:messages")
+
+    @fail_silently()
+    async def get_members(self, chat_group_id: UUID) -> Optional[List[UUID]]:
+        members = await self._cache.smembers(
+            f"chat_groups:{chat_group_id}:members", encoding="utf-8")
+        return [UUID(profile_id) for profile_id in members] \
+            if members else None
+
+    @fail_silently(default={})
+    async def get_memberships(
+            self,
+            profile_id: UUID,
+            chat_group_ids: List[UUID]) -> Dict[UUID, bool]:
+        """Return whether a profile belongs to each of the chat groups whose
+        members are cached, omitting the other ones."""
+        pipe = self._cache.pipeline()
+        lookups = [(chat_group_id,
+                    pipe.exists(f"chat_groups:{chat_group_id}:members"),
+                    pipe.sismember(f"chat_groups:{chat_group_id}:members",
+                                   str(profile_id)))
+                   for chat_group_id in chat_group_ids]
+        await pipe.execute()
+        return {chat_group_id: bool(await is_member)
+                for chat_group_id, cached, is_member in lookups
+                if await cached}
+
+    @fail_silently()
+    async def set_members(
+            self,
+            chat_group_id: UUID,
+            profile_ids: List[UUID]) -> None:
+        if not profile_ids:
+            return
+        pipe = self._cache.multi_exec()
+        pipe.delete(f"chat_groups:{chat_group_id}:members")
+        pipe.sadd(f"chat_groups:{chat_group_id}:members",
+                  *[str(profile_id) for profile_id in profile_ids])
+        pipe.expire(f"chat_groups:{chat_group_id}:members",
+                    ChatCache.MEMBERS_EX)
+        await pipe.execute()
+
+    @fail_silently()
+    async def unset_members(self, chat_group_id: UUID) -> None:
+        await self._cache.delete(f"chat_groups:{chat_group_id}:members")
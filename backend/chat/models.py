@@ -4,7 +4,7 @@ from uuid import UUID
 
 from pydantic import BaseModel
 from sqlalchemy import Column, String, Table, ForeignKey, DateTime, Text, \
-    UniqueConstraint, Boolean
+    UniqueConstraint, Boolean, Index, text
 
 from database.core import metadata
 from database.utils import uuid_pk, created_at, PgUUID
@@ -65,6 +65,50 @@ chat_message = Table(
     Column("content", String),
 )
 
+# last message of each chat group and the last message read, one row per
+# member, maintained on write to serve conversation lists with a single index
+# scan: a conversation is unread when its last message is newer than the last
+# one read by the member
+conversation_summary = Table(
+    "conversation_summary", metadata,
+    Column("profile_id", PgUUID, ForeignKey("profile.id", ondelete="CASCADE"),
+           primary_key=True),
+    Column("chat_group_id", PgUUID,
+           ForeignKey("chat_group.id", ondelete="CASCADE"),
+           primary_key=True),
+    Column("chat_group_name",
+           Text),
+    Column("active",
+           Boolean,
+           server_default="true",
+           nullable=False),
+    Column("last_message_id", PgUUID,
+           ForeignKey("chat_message.id", ondelete="CASCADE"),
+           nullable=False),
+    Column("last_message_from_profile_id", PgUUID,
+           ForeignKey("profile.id", ondelete="CASCADE"),
+           nullable=False),
+    Column("last_message_from_username",
+           Text,
+           nullable=False),
+    Column("last_message_content",
+           String),
+    Column("last_message_created_at",
+           DateTime(timezone=True),
+           nullable=False),
+    # creation date of the latest message read by the member
+    Column("last_read_at",
+           DateTime(timezone=True)),
+    Index("ix_conversation_summary_profile_id_last_message_created_at",
+          "profile_id", text("last_message_created_at DESC"),
+          postgresql_where=text("active = true")),
+    Index("ix_conversation_summary_profile_id_unread",
+          "profile_id",
+          postgresql_where=text(
+              "active = true AND (last_read_at IS NULL "
+              "OR last_read_at < last_message_created_at)"))
+)
+
 
 class ChatMessage(BaseModel):
     id: Optional[UUID]
@@ -74,6 +118,13 @@ class ChatMessage(BaseModel):
     content: str
 
 
+class ChatMessageReadStatus(BaseModel):
+    profile_id: UUID
+    chat_group_id: UUID
+    chat_message_id: UUID
+    read_at: dt.datetime
+
+
 class ChatGroup(BaseModel):
     id: Optional[UUID]
     name: Optional[str]
@@ -89,9 +140,20 @@ class Conversation(BaseModel):
     chat_group_id: UUID
     chat_group_name: str
     read_at: Optional[dt.datetime]
+    last_message_id: Optional[UUID]
 
 
 class PrivateChat(BaseModel):
     chat_group_id: UUID
     profile_id: UUID
     username: str
+
+
+class ChatMessageMetrics(BaseModel):
+    sent: int = 0
+    failed: int = 0
+    typing_forwarded: int = 0
+    typing_dropped: int = 0
+    latency_p50_ms: Optional[float]
+    latency_p95_ms: Optional[float]
+    latency_max_ms: Optional[float]
@@ -1,33 +1,101 @@
 import datetime as dt
-from typing import Optional, List
+import json
+from collections import defaultdict
+from typing import Optional, List, Tuple, Dict
 from uuid import UUID
 
 import asyncpg
-import sqlalchemy
-from injector import singleton
-from sqlalchemy import insert, select, delete, desc, update
+from fastapi.encoders import jsonable_encoder
+from injector import singleton, inject
+from sqlalchemy import insert, select, delete, desc, update, case, text, JSON
 
+from chat.cache import ChatCache
 from chat.exceptions import NonExistentChatGroup
 from chat.models import ChatMessage, chat_message, chat_group, ChatGroup, \
-    profile_chat_group, chat_message_read_status, Conversation, PrivateChat
+    profile_chat_group, Conversation, PrivateChat, conversation_summary, \
+    ChatMessageReadStatus
 from common.injection import injector
 from database.core import db
-from database.utils import map_result
+from database.utils import map_result, map_to
 
 
 @singleton
 class ChatRepo:
-    @map_result
-    async def save_chat_message(self, new_message: ChatMessage) -> ChatMessage:
+    # other members of the active private chats of a profile
+    PRIVATE_CHATS_FROM_SQL: str = """FROM profile_chat_group pcg1
+        JOIN profile_chat_group pcg2 ON pcg1.chat_group_id = pcg2.chat_group_id
+        JOIN chat_group cg ON cg.id = pcg2.chat_group_id
+        JOIN profile p ON p.id = pcg2.profile_id
+    WHERE pcg1.profile_id != pcg2.profile_id
+        AND pcg1.profile_id = :profile_id
+        AND cg.private = TRUE
+        AND cg.active = TRUE"""
+
+    @inject
+    def __init__(self, cache: ChatCache):
+        self._cache = cache
+
+    async def save_chat_message_read_by_sender(
+            self, new_message: ChatMessage) -> ChatMessage:
+        # insert the message, mark it as read by its sender and make it the
+        # last message of every member's conversation summary in a single
+        # statement (foreign keys are checked at the end of the statement)
+        query = """
+        WITH new_message AS (
+            INSERT INTO chat_message (from_profile_id, chat_group_id, content)
+            VALUES (:from_profile_id, :chat_group_id, :content)
+            RETURNING id, created_at, from_profile_id, chat_group_id, content
+        ), read_status AS (
+            INSERT INTO chat_message_read_status
+                (profile_id, chat_group_id, chat_message_id, read_at)
+            SELECT from_profile_id, chat_group_id, id, created_at
+            FROM new_message
+            ON CONFLICT ON CONSTRAINT profile_id_chat_group_id_idx DO UPDATE
+            SET chat_message_id = EXCLUDED.chat_message_id,
+                read_at = EXCLUDED.read_at
+        ), summary AS (
+            INSERT INTO conversation_summary AS cs
+                (profile_id, chat_group_id, chat_group_name, active,
+                last_message_id, last_message_from_profile_id,
+                last_message_from_username, last_message_content,
+                last_message_created_at, last_read_at)
+            SELECT pcg.profile_id, m.chat_group_id, COALESCE(pcg.name, cg.name),
+                cg.active, m.id, m.from_profile_id, p.username, m.content,
+                m.created_at,
+                CASE WHEN pcg.profile_id = m.from_profile_id
+                    THEN m.created_at END
+            FROM new_message m
+                JOIN profile_chat_group pcg ON pcg.chat_group_id = m.chat_group_id
+                JOIN chat_group cg ON cg.id = m.chat_group_id
+                JOIN profile p ON p.id = m.from_profile_id
+            ON CONFLICT (profile_id, chat_group_id) DO UPDATE
+            SET chat_group_name = EXCLUDED.chat_group_name,
+                active = EXCLUDED.active,
+                last_message_id = EXCLUDED.last_message_id,
+                last_message_from_profile_id =
+                    EXCLUDED.last_message_from_profile_id,
+                last_message_from_username = EXCLUDED.last_message_from_username,
+                last_message_content = EXCLUDED.last_message_content,
+                last_message_created_at = EXCLUDED.last_message_created_at,
+                last_read_at = GREATEST(cs.last_read_at, EXCLUDED.last_read_at)
+            WHERE cs.last_message_created_at <= EXCLUDED.last_message_created_at
+        )
+        SELECT * FROM new_message"""
         try:
-            return await db.fetch_one(
-                insert(chat_message)
-                    .values(new_message.dict(exclude_none=True))
-                    .returning(chat_message))
+            saved_message = await db.fetch_one(
+                query=query,
+                values=dict(from_profile_id=new_message.from_profile_id,
+                            chat_group_id=new_message.chat_group_id,
+                            content=new_message.content))
         except asyncpg.exceptions.ForeignKeyViolationError as e:
-            if e.constraint_name == "chat_message_chat_group_id_fkey":
+            if e.constraint_name in [
+                    "chat_message_chat_group_id_fkey",
+                    "chat_message_read_status_chat_group_id_fkey"]:
                 raise NonExistentChatGroup()
             raise
+        saved_message: ChatMessage = map_to(saved_message, ChatMessage)
+        await self._cache.add_message(saved_message)
+        return saved_message
 
     @map_result
     @db.transaction()
@@ -65,31 +133,59 @@ class ChatRepo:
             values = [dict(profile_id=profile_id, chat_group_id=chat_group_id)
                       for profile_id in profile_ids]
         await db.execute_many(query=query, values=values)
+        await self._cache.unset_members(chat_group_id)
 
-    async def update_chat_message_read_status(
-            self,
-            profile_id: UUID,
-            chat_group_id: UUID,
-            chat_message_id: UUID):
-        return await db.fetch_one(
-            sqlalchemy.dialects.postgresql.insert(
-                chat_message_read_status).values(
-                profile_id=profile_id,
-                chat_group_id=chat_group_id,
-                chat_message_id=chat_message_id,
-                read_at=dt.datetime.now(dt.timezone.utc))
-                .on_conflict_do_update(
-                constraint="profile_id_chat_group_id_idx",
-                set_=dict(chat_message_id=chat_message_id,
-                          read_at=dt.datetime.now(dt.timezone.utc))))
+    async def update_chat_messages_read_status(
+            self, read_statuses: List[ChatMessageReadStatus]) -> None:
+        # move each member's last read message forward (marks may arrive out
+        # of order), skipping marks of messages which don't belong to a chat
+        # group of the member (e.g. deleted in the meanwhile)
+        if not read_statuses:
+            return
+        query = """
+        WITH read_status AS (
+            INSERT INTO chat_message_read_status
+                (profile_id, chat_group_id, chat_message_id, read_at)
+            SELECT incoming.profile_id, incoming.chat_group_id,
+                incoming.chat_message_id, incoming.read_at
+            FROM json_to_recordset(CAST(:rows AS json)) AS incoming(
+                profile_id uuid, chat_group_id uuid, chat_message_id uuid,
+                read_at timestamptz)
+                JOIN chat_message cm ON cm.id = incoming.chat_message_id
+                    AND cm.chat_group_id = incoming.chat_group_id
+                JOIN profile_chat_group pcg
+                    ON pcg.profile_id = incoming.profile_id
+                    AND pcg.chat_group_id = incoming.chat_group_id
+            ON CONFLICT ON CONSTRAINT profile_id_chat_group_id_idx DO UPDATE
+            SET chat_message_id = EXCLUDED.chat_message_id,
+                read_at = EXCLUDED.read_at
+            RETURNING profile_id, chat_group_id, chat_message_id
+        )
+        UPDATE conversation_summary cs
+        SET last_read_at = GREATEST(cs.last_read_at, cm.created_at)
+        FROM read_status rs
+            JOIN chat_message cm ON cm.id = rs.chat_message_id
+        WHERE cs.profile_id = rs.profile_id
+            AND cs.chat_group_id = rs.chat_group_id"""
+        await db.execute(
+            query=query,
+            values=dict(rows=json.dumps(jsonable_encoder(read_statuses))))
 
     @map_result
+    @db.transaction()
     async def update_chat_group(self, chat_group_id: UUID, active: bool) \
             -> ChatGroup:
-        return await db.fetch_one(update(chat_group)
-                                  .where(chat_group.c.id == chat_group_id)
-                                  .values(active=active)
-                                  .returning(chat_group))
+        await db.execute(
+            update(conversation_summary)
+                .where(conversation_summary.c.chat_group_id == chat_group_id)
+                .values(active=active))
+        updated_chat_group = await db.fetch_one(
+            update(chat_group)
+                .where(chat_group.c.id == chat_group_id)
+                .values(active=active)
+                .returning(chat_group))
+        await self._cache.unset_members(chat_group_id)
+        return updated_chat_group
 
     @map_result
     async def find_conversations_by_profile_id(
@@ -98,77 +194,113 @@ class ChatRepo:
             older_than: Optional[dt.datetime] = None,
             limit: int = 10) -> List[Conversation]:
         older_than = older_than or dt.datetime.now(dt.timezone.utc)
-        query = """
-        SELECT * FROM (
-            SELECT DISTINCT ON (pcg.profile_id, pcg.chat_group_id)
-                cm.from_profile_id, cm.content, cm.created_at, p.username from_profile_username, cm.chat_group_id, COALESCE (pcg.name, cg.name) chat_group_name, cmrs.read_at
-            FROM chat_message cm
-                JOIN profile_chat_group pcg on cm.chat_group_id = pcg.chat_group_id
-                JOIN chat_group cg ON cm.chat_group_id = cg.id
-                JOIN profile p ON cm.from_profile_id = p.id
-                LEFT OUTER JOIN chat_message_read_status cmrs ON cm.id = cmrs.chat_message_id
-                    AND cmrs.profile_id = pcg.profile_id
-            WHERE pcg.profile_id = :profile_id
-                AND cg.active = true
-            ORDER BY pcg.profile_id, pcg.chat_group_id, cm.created_at DESC
-        ) conversations
-        WHERE created_at < :older_than
-        ORDER BY created_at DESC
-        LIMIT :limit"""
+        summary = conversation_summary.c
         return await db.fetch_all(
-            query=query,
-            values=dict(
-                profile_id=profile_id, older_than=older_than, limit=limit))
-
-    async def find_unread_conversations_ids_by_profile_id(
-            self, profile_id: UUID) -> List[UUID]:
-        query = """SELECT chat_group_id FROM (
-        SELECT chat_group_id, read_at FROM (
-            SELECT DISTINCT ON (pcg.profile_id, pcg.chat_group_id) cmrs.read_at read_at, pcg.chat_group_id chat_group_id
-            FROM chat_message cm
-                JOIN profile_chat_group pcg ON cm.chat_group_id = pcg.chat_group_id
-                JOIN chat_group cg ON cm.chat_group_id = cg.id
-                LEFT OUTER JOIN chat_message_read_status cmrs
-            ON cm.id = cmrs.chat_message_id AND cmrs.profile_id = pcg.profile_id
-            WHERE pcg.profile_id = :profile_id
-                AND cg.active = TRUE
-            ORDER BY pcg.profile_id, pcg.chat_group_id, cm.created_at DESC
-            ) conversations
-        WHERE read_at IS NULL) unread_conversations"""
-        results = await db.fetch_all(
-            query=query,
-            values=dict(profile_id=profile_id))
-        return [result["chat_group_id"] for result in results]
+            select([summary.last_message_from_profile_id.label(
+                        "from_profile_id"),
+                    summary.last_message_from_username.label(
+                        "from_profile_username"),
+                    summary.last_message_content.label("content"),
+                    summary.last_message_created_at.label("created_at"),
+                    summary.chat_group_id,
+                    summary.chat_group_name,
+                    summary.last_message_id,
+                    case([(summary.last_read_at
+                           >= summary.last_message_created_at,
+                           summary.last_read_at)]).label("read_at")])
+                .where(summary.profile_id == profile_id)
+                .where(summary.active == True)
+                .where(summary.last_message_created_at < older_than)
+                .order_by(desc(summary.last_message_created_at))
+                .limit(limit))
 
     @map_result
     async def find_private_chats_by_profile_id(self, profile_id: UUID) \
             -> List[PrivateChat]:
-        query = """SELECT cg.id chat_group_id, pcg2.profile_id, p.username
-        FROM profile_chat_group pcg1
-            JOIN profile_chat_group pcg2 ON pcg1.chat_group_id = pcg2.chat_group_id
-            JOIN chat_group cg ON cg.id = pcg2.chat_group_id
-            JOIN profile p ON p.id = pcg2.profile_id
-        WHERE pcg1.profile_id != pcg2.profile_id
-            AND pcg1.profile_id = :profile_id
-            AND cg.private = TRUE
-            AND cg.active = TRUE"""
+        query = f"""SELECT cg.id chat_group_id, pcg2.profile_id, p.username
+        {ChatRepo.PRIVATE_CHATS_FROM_SQL}"""
         return await db.fetch_all(
             query=query,
             values=dict(profile_id=profile_id))
 
+    async def find_chat_bootstrap_by_profile_id(
+            self,
+            profile_id: UUID,
+            read_chat_message_ids: List[UUID] = ()) \
+            -> Tuple[List[PrivateChat], List[UUID]]:
+        # private chats and unread conversations ids in a single round trip;
+        # 'read_chat_message_ids' are messages marked as read but not yet saved
+        query = text(f"""
+        SELECT (
+            SELECT COALESCE(json_agg(json_build_object(
+                'chat_group_id', cg.id,
+                'profile_id', pcg2.profile_id,
+                'username', p.username)), '[]')
+            {ChatRepo.PRIVATE_CHATS_FROM_SQL}
+        ) private_chats, (
+            SELECT COALESCE(json_agg(chat_group_id), '[]')
+            FROM conversation_summary
+            WHERE profile_id = :profile_id
+                AND active = true
+                AND (last_read_at IS NULL
+                    OR last_read_at < last_message_created_at)
+                AND last_message_id
+                    != ALL(CAST(:read_chat_message_ids AS uuid[]))
+        ) unread_conversations_ids""") \
+            .bindparams(profile_id=profile_id,
+                        read_chat_message_ids=list(read_chat_message_ids)) \
+            .columns(private_chats=JSON, unread_conversations_ids=JSON)
+        result = await db.fetch_one(query)
+        return map_to(result["private_chats"], List[PrivateChat]), \
+               [UUID(chat_group_id)
+                for chat_group_id in result["unread_conversations_ids"]]
+
     async def find_chat_group_members_profile_ids(self, group_id: UUID) \
             -> List[UUID]:
+        if (profile_ids := await self._cache.get_members(group_id)) is not None:
+            return profile_ids
         results = await db.fetch_all(
             select([profile_chat_group.c.profile_id])
                 .where(profile_chat_group.c.chat_group_id == group_id))
-        return [result["profile_id"] for result in results]
+        profile_ids = [result["profile_id"] for result in results]
+        await self._cache.set_members(group_id, profile_ids)
+        return profile_ids
+
+    async def is_chat_groups_member(
+            self,
+            profile_id: UUID,
+            chat_group_ids: List[UUID]) -> bool:
+        memberships = await self._cache.get_memberships(
+            profile_id, chat_group_ids)
+        if any(memberships.values()):
+            return True
+        uncached_ids = [chat_group_id for chat_group_id in chat_group_ids
+                        if chat_group_id not in memberships]
+        if not uncached_ids:
+            return False
+        # fill uncached memberships with a single query
+        results = await db.fetch_all(
+            select([profile_chat_group.c.chat_group_id,
+                    profile_chat_group.c.profile_id])
+                .where(profile_chat_group.c.chat_group_id.in_(uncached_ids)))
+        members: Dict[UUID, List[UUID]] = defaultdict(list)
+        for result in results:
+            members[result["chat_group_id"]].append(result["profile_id"])
+        for chat_group_id, profile_ids in members.items():
+            await self._cache.set_members(chat_group_id, profile_ids)
+        return any(profile_id in profile_ids
+                   for profile_ids in members.values())
 
     @map_result
     async def delete_chat_group(self, chat_group_id: UUID) \
             -> Optional[ChatGroup]:
-        return await db.fetch_one(delete(chat_group)
-                                  .where(chat_group.c.id == chat_group_id)
-                                  .returning(chat_group))
+        deleted_chat_group = await db.fetch_one(
+            delete(chat_group)
+                .where(chat_group.c.id == chat_group_id)
+                .returning(chat_group))
+        await self._cache.unset_messages(chat_group_id)
+        await self._cache.unset_members(chat_group_id)
+        return deleted_chat_group
 
     @map_result
     async def find_private_chat_group(
@@ -186,16 +318,25 @@ class ChatRepo:
             values=dict(profile_id=profile_id,
                         other_profile_id=other_profile_id))
 
-    @map_result
     async def find_chat_group_messages(
             self,
             chat_group_id: UUID,
             older_than: Optional[dt.datetime] = None,
             limit: int = 10) -> List[ChatMessage]:
+        # pages past the latest messages cached are read from PostgreSQL, while
+        # reading the first page fills the cache
+        first_page = older_than is None
         older_than = older_than or dt.datetime.now(dt.timezone.utc)
-        return await db.fetch_all(
+        if (messages := await self._cache.get_messages(
+                chat_group_id, older_than, limit)) is not None:
+            return messages
+        messages = map_to(await db.fetch_all(
             select([chat_message])
                 .where(chat_message.c.chat_group_id == chat_group_id)
                 .where(chat_message.c.created_at < older_than)
                 .order_by(desc(chat_message.c.created_at))
-                .limit(limit))
+                .limit(max(limit, ChatCache.MESSAGES_COUNT)
+                       if first_page else limit)), List[ChatMessage])
+        if first_page:
+            await self._cache.set_messages(chat_group_id, messages)
+        return messages[:limit]
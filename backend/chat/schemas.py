@@ -29,7 +29,22 @@ class IsTypingWsMessage(BaseSchema):
     chat_group_id: UUID
 
 
+class FriendPresenceWsMessage(BaseSchema):
+    profile_id: UUID
+    online: bool
+
+
 class PrivateChatRead(BaseSchema):
     chat_group_id: UUID
     profile_id: UUID
     username: str
+
+
+class ChatMessageMetricsRead(BaseSchema):
+    sent: int
+    failed: int
+    typing_forwarded: int
+    typing_dropped: int
+    latency_p50_ms: Optional[float]
+    latency_p95_ms: Optional[float]
+    latency_max_ms: Optional[float]
@@ -1,7 +1,10 @@
 import asyncio
 import datetime as dt
+import math
+import time
 from asyncio import get_event_loop
-from typing import Optional, List, Dict, Union
+from collections import defaultdict, deque
+from typing import Optional, List, Dict, Union, Set, Deque, Any, Tuple
 from uuid import UUID
 
 import socketio
@@ -9,20 +12,51 @@ from fastapi.encoders import jsonable_encoder
 from injector import singleton, inject
 
 from auth.models import User
-from chat.models import ChatMessage, Conversation, PrivateChat
+from chat.models import ChatMessage, Conversation, PrivateChat, \
+    ChatMessageMetrics, ChatMessageReadStatus
 from chat.repo import ChatRepo
-from chat.schemas import IsTypingWsMessage, ChatMessageRead, PrivateChatRead
+from chat.schemas import IsTypingWsMessage, ChatMessageRead, PrivateChatRead, \
+    FriendPresenceWsMessage
+from common.log import logger
+from config import cfg
 from pubsub.websocket import WebSockets, WsRouter, get_sio_session, \
     save_sio_session, SioSession
 
+ReadStatuses = Dict[UUID, Dict[UUID, ChatMessageReadStatus]]
+
 
 @singleton
 class ChatService(WsRouter):
+    LATENCY_SAMPLES: int = 1000
+    TYPING_PRUNE_SIZE: int = 10000
+
     @inject
     def __init__(self, repo: ChatRepo, ws: WebSockets):
         self._repo = repo
         self._ws = ws
         self._sio = ws.sio
+        # sids connected to this worker, by the friend profile id whose
+        # presence changes they are interested in
+        self._presence_watchers: Dict[str, Set[str]] = defaultdict(set)
+        self._metrics = ChatMessageMetrics()
+        self._latencies: Deque[float] = deque(
+            maxlen=ChatService.LATENCY_SAMPLES)
+        # last time a typing event was forwarded, by (chat group id, profile id)
+        self._typing_forwarded_at: Dict[Tuple[UUID, UUID], float] = {}
+        # latest read marks not yet saved, by profile id and chat group id:
+        # pending ones and the ones being flushed
+        self._read_statuses: ReadStatuses = defaultdict(dict)
+        self._flushing_read_statuses: ReadStatuses = {}
+        # must postpone Lock creation to FastAPI startup event
+        self._flush_lock = None
+
+    def start(self):
+        self._flush_lock = asyncio.Lock()
+        get_event_loop().create_task(self._listen_for_presence_changes())
+        get_event_loop().create_task(self._flush_read_statuses_periodically())
+
+    async def stop(self):
+        await self._flush_read_statuses()
 
     async def get_conversation_messages(
             self,
@@ -39,10 +73,18 @@ class ChatService(WsRouter):
             older_than: Optional[dt.datetime] = None,
             limit: int = 10) -> List[Conversation]:
         """Get conversations for a specific profile."""
-        return await self._repo.find_conversations_by_profile_id(
+        conversations = await self._repo.find_conversations_by_profile_id(
             profile_id,
             older_than,
             limit)
+        read_statuses = self._get_buffered_read_statuses(profile_id)
+        for conversation in conversations:
+            read_status = read_statuses.get(conversation.chat_group_id)
+            if not conversation.read_at and read_status \
+                    and read_status.chat_message_id \
+                    == conversation.last_message_id:
+                conversation.read_at = read_status.read_at
+        return conversations
 
     async def get_chat_group_members_profile_ids(self, chat_group_id: UUID) \
             -> List[UUID]:
@@ -50,12 +92,32 @@ class ChatService(WsRouter):
         return await self._repo.find_chat_group_members_profile_ids(
             chat_group_id)
 
+    async def is_chat_group_member(
+            self,
+            profile_id: UUID,
+            *chat_group_ids: UUID) -> bool:
+        """Check whether a profile is member of any of the given chat groups."""
+        return await self._repo.is_chat_groups_member(
+            profile_id, list(chat_group_ids))
+
     async def get_private_chats_by_profile_id(self, profile_id: UUID) \
             -> List[PrivateChat]:
         """Return all private chat groups for a specific profile.."""
         return await self._repo.find_private_chats_by_profile_id(profile_id)
 
+    def metrics(self) -> ChatMessageMetrics:
+        """Return a snapshot of chat messages metrics, including latency
+        between receiving a message and delivering it to recipients."""
+        latencies = sorted(self._latencies)
+        percentile = lambda p: latencies[int(p * (len(latencies) - 1))] \
+            if latencies else None
+        return self._metrics.copy(update=dict(
+            latency_p50_ms=percentile(0.5),
+            latency_p95_ms=percentile(0.95),
+            latency_max_ms=latencies[-1] if latencies else None))
+
     async def _on_chat_message(self, sid: str, data: Dict):
+        received_at = time.time()
         message, to = data["message"], UUID(data["to"])
         session = await get_sio_session(sid)
         if to not in [chat.chat_group_id
@@ -65,24 +127,32 @@ class ChatService(WsRouter):
             from_profile_id=session.user.id,
             chat_group_id=to,
             content=message)
-        chat_message = await self._repo.save_chat_message(chat_message)
-        await self._repo.update_chat_message_read_status(
-            session.user.id,
-            to,
-            chat_message.id)
+        try:
+            chat_message = await self._repo.save_chat_message_read_by_sender(
+                chat_message)
+        except Exception as e:
+            self._metrics.failed += 1
+            raise
         message_data = ChatMessageRead(
             id=chat_message.id,
             content=message,
             from_profile_id=session.user.id,
             chat_group_id=chat_message.chat_group_id,
             created_at=chat_message.created_at)
-        for recipient in (await self._get_message_recipients(to, sid)):
-            await self._ws.send("chat_message", message_data, to=recipient)
+        await asyncio.gather(*[
+            self._ws.send("chat_message", message_data, to=recipient)
+            for recipient in await self._get_message_recipients(to, sid)])
+        self._metrics.sent += 1
+        self._latencies.append((time.time() - received_at) * 1000)
         return jsonable_encoder(message_data)
 
     async def _on_is_typing(self, sid: str, data: Dict):
         chat_group_id = UUID(data["chatGroupId"])
         session = await get_sio_session(sid)
+        if not self._should_forward_typing(chat_group_id, session.user.id):
+            self._metrics.typing_dropped += 1
+            return
+        self._metrics.typing_forwarded += 1
         message_data = IsTypingWsMessage(
             profile_id=session.user.id,
             username=session.user.username,
@@ -91,14 +161,69 @@ class ChatService(WsRouter):
                 chat_group_id, sid, exclude_sender_id=session.user.id)):
             await self._ws.send("is_typing", message_data, to=recipient)
 
+    def _should_forward_typing(self, chat_group_id: UUID, profile_id: UUID) \
+            -> bool:
+        # forward the first event of each throttle window and coalesce the
+        # following ones, since recipients keep showing the indicator anyway
+        now = time.monotonic()
+        key = (chat_group_id, profile_id)
+        if now - self._typing_forwarded_at.get(key, -math.inf) \
+                < cfg.chat_typing_throttle:
+            return False
+        if len(self._typing_forwarded_at) >= ChatService.TYPING_PRUNE_SIZE:
+            self._typing_forwarded_at = {
+                k: forwarded_at
+                for k, forwarded_at in self._typing_forwarded_at.items()
+                if now - forwarded_at < cfg.chat_typing_throttle}
+        self._typing_forwarded_at[key] = now
+        return True
+
     async def _on_mark_chat_as_read(self, sid: str, data: Dict):
-        chat_group_id, chat_message_id = data["chatGroupId"], \
-                                         data["chatMessageId"]
         session = await get_sio_session(sid)
-        await self._repo.update_chat_message_read_status(
-            session.user.id,
-            chat_group_id,
-            chat_message_id)
+        read_status = ChatMessageReadStatus(
+            profile_id=session.user.id,
+            chat_group_id=UUID(data["chatGroupId"]),
+            chat_message_id=UUID(data["chatMessageId"]),
+            read_at=dt.datetime.now(dt.timezone.utc))
+        # only the latest mark of each chat group is saved
+        self._read_statuses[read_status.profile_id][
+            read_status.chat_group_id] = read_status
+
+    def _get_buffered_read_statuses(self, profile_id: UUID) \
+            -> Dict[UUID, ChatMessageReadStatus]:
+        return {**self._flushing_read_statuses.get(profile_id, {}),
+                **self._read_statuses.get(profile_id, {})}
+
+    async def _flush_read_statuses_periodically(self):
+        while True:
+            await asyncio.sleep(cfg.chat_read_receipts_flush_interval)
+            try:
+                await self._flush_read_statuses()
+            except Exception as e:
+                logger.error("Read receipts flush failed")
+
+    async def _flush_read_statuses(self):
+        # save every buffered mark with a single statement; marks stay visible
+        # to readers until saved, and are kept for the next flush on failure
+        # unless superseded by newer ones; flushes (periodic ones and the one
+        # on shutdown) run one at a time, as they share the flushing buffer
+        async with self._flush_lock:
+            self._flushing_read_statuses, self._read_statuses = \
+                self._read_statuses, defaultdict(dict)
+            try:
+                await self._repo.update_chat_messages_read_status(
+                    [read_status
+                     for read_statuses in self._flushing_read_statuses.values()
+                     for read_status in read_statuses.values()])
+            except Exception:
+                for profile_id, read_statuses in \
+                        self._flushing_read_statuses.items():
+                    for chat_group_id, read_status in read_statuses.items():
+                        self._read_statuses[profile_id].setdefault(
+                            chat_group_id, read_status)
+                raise
+            finally:
+                self._flushing_read_statuses = {}
 
     async def _get_message_recipients(
             self,
@@ -120,38 +245,53 @@ class ChatService(WsRouter):
                 if (True if not exclude_sender_id
                     else str(profile_id) != str(exclude_sender_id))]
 
-    async def _on_ws_connect(self, sid: str, user: User):
-        private_chats = await self.get_private_chats_by_profile_id(user.id)
-        unread_conversations_ids = await \
-            self._repo.find_unread_conversations_ids_by_profile_id(user.id)
+    async def _on_ws_connect(self, sid: str, user: User) -> Dict[str, Any]:
+        private_chats, unread_conversations_ids = \
+            await self._repo.find_chat_bootstrap_by_profile_id(
+                user.id,
+                [read_status.chat_message_id for read_status
+                 in self._get_buffered_read_statuses(user.id).values()])
         await save_sio_session(sid, SioSession(user=user,
                                                private_chats=private_chats))
-        await self._ws.send(
-            event="unread_conversations_ids",
-            payload=unread_conversations_ids,
-            to=sid)
-        await self._ws.send(
-            event="private_chats",
-            payload=[PrivateChatRead(**chat.dict()) for chat in private_chats],
-            to=sid)
-        get_event_loop().create_task(self._online_friends_task(sid))
-
-    async def _online_friends_task(self, sid: str):
-        while True:
+        # watch before reading current statuses so that no change is missed
+        friends_ids = [str(chat.profile_id) for chat in private_chats]
+        for friend_id in friends_ids:
+            self._presence_watchers[friend_id].add(sid)
+        return {
+            "unread_conversations_ids": unread_conversations_ids,
+            "private_chats": [PrivateChatRead(**chat.dict())
+                              for chat in private_chats],
+            "online_friends":
+                await self._ws.store.get_online_statuses(friends_ids)}
+
+    def _on_ws_disconnect(self, sid: str, session: SioSession):
+        for chat in session.private_chats:
+            friend_id = str(chat.profile_id)
+            self._presence_watchers[friend_id].discard(sid)
+            if not self._presence_watchers[friend_id]:
+                del self._presence_watchers[friend_id]
+
+    async def _listen_for_presence_changes(self):
+        # each worker delivers presence changes to its own sockets only
+        async for profile_id, online in \
+                self._ws.store.listen_for_presence_changes():
             try:
-                session = await get_sio_session(sid)
-            except KeyError:
-                return
-            friends_uuids = [friend.profile_id
-                             for friend in session.private_chats]
-            await self._ws.send(
-                event="online_friends",
-                payload=await self._ws.store.get_online_statuses(friends_uuids),
-                to=sid)
-            await asyncio.sleep(5)
+                await self._send_presence_change(profile_id, online)
+            except Exception as e:
+                logger.error("Presence change delivery failed")
+
+    async def _send_presence_change(self, profile_id: str, online: bool):
+        if not (watchers := self._presence_watchers.get(profile_id)):
+            return
+        message_data = FriendPresenceWsMessage(profile_id=profile_id,
+                                               online=online)
+        await asyncio.gather(*[
+            self._ws.send("friend_presence", message_data, to=sid, local=True)
+            for sid in list(watchers)])
 
     def subscribe_to_on_connect(self):
         self._ws.subscribe_to_on_connect(self._on_ws_connect)
+        self._ws.subscribe_to_on_disconnect(self._on_ws_disconnect)
 
     def add_ws_routes(self, sio: socketio.AsyncServer):
         sio.on("chat_message", self._on_chat_message)
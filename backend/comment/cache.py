@@ -1,13 +1,13 @@
 import datetime as dt
 import json
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from uuid import UUID
 
 from fastapi.encoders import jsonable_encoder
 from injector import singleton, inject
 
 from comment.models import Comment
-from common.cache import fail_silently, hash_cache_key
+from common.cache import fail_silently, hash_cache_key, LocalCaches
 from common.injection import Cache
 from database.utils import map_to
 
@@ -15,33 +15,71 @@ from database.utils import map_to
 @singleton
 class CommentCache:
     COMMENTS_EX: int = int(dt.timedelta(minutes=1).total_seconds())
+    # comments pages of a post are keyed by a generation counter, bumped on
+    # write to invalidate all of them at once; it must outlive the pages
+    GENERATION_EX: int = int(dt.timedelta(days=1).total_seconds())
+    GET_COMMENTS_SCRIPT: str = """
+    local generation = redis.call('GET', KEYS[1]) or '0'
+    return {generation, redis.call('GET', ARGV[1] .. generation .. ARGV[2])}"""
 
     @inject
-    def __init__(self, cache: Cache):
+    def __init__(self, cache: Cache, local_caches: LocalCaches):
         self._cache = cache
+        self._local_caches = local_caches
+        self._local = local_caches.create("comments")
 
-    @fail_silently()
+    @fail_silently(default=(0, None))
     async def get_comments(
             self,
             post_id: UUID,
-            older_than: dt.datetime) -> Optional[List[Comment]]:
-        cached_comments = await self._cache.get(
-            f"posts:{post_id}:comments:{hash_cache_key(older_than)}")
-        return cached_comments and map_to(json.loads(cached_comments),
-                                          List[Comment])
+            older_than: Optional[dt.datetime],
+            limit: int) -> Tuple[int, Optional[List[Comment]]]:
+        """Return current comments generation of a post along with the cached
+        page, which must be cached again with that generation if missing."""
+        page_key = hash_cache_key(older_than, limit)
+        generation = self._local.get(f"posts:{post_id}:comments:generation")
+        if generation is not None and (comments := self._local.get(
+                f"posts:{post_id}:comments:{generation}:{page_key}")) \
+                is not None:
+            return generation, comments
+        generation, cached_comments = await self._cache.eval(
+            CommentCache.GET_COMMENTS_SCRIPT,
+            keys=[f"posts:{post_id}:comments:generation"],
+            args=[f"posts:{post_id}:comments:", f":{page_key}"])
+        generation = int(generation)
+        self._local.record_redis_read(cached_comments is not None)
+        comments = cached_comments and map_to(json.loads(cached_comments),
+                                              List[Comment])
+        self._local.set(f"posts:{post_id}:comments:generation", generation)
+        self._local.set(f"posts:{post_id}:comments:{generation}:{page_key}",
+                        comments)
+        return generation, comments
 
     @fail_silently()
     async def set_comments(
             self,
             comments: List[Comment],
             post_id: UUID,
-            older_than: Optional[dt.date]) -> None:
+            older_than: Optional[dt.datetime],
+            limit: int,
+            generation: int) -> None:
+        # a page read before a bump is cached with the outdated generation,
+        # so it is never served
         await self._cache.set(
-            f"posts:{post_id}:comments:{hash_cache_key(older_than)}",
+            f"posts:{post_id}:comments:{generation}:"
+            f"{hash_cache_key(older_than, limit)}",
             json.dumps([jsonable_encoder(c) for c in comments]),
             expire=CommentCache.COMMENTS_EX)
+        self._local.set(f"posts:{post_id}:comments:{generation}:"
+                        f"{hash_cache_key(older_than, limit)}",
+                        map_to(comments, List[Comment]))
 
     @fail_silently()
-    async def unset_latest_comments(self, post_id: UUID) -> None:
-        await self._cache.delete(
-            f"posts:{post_id}:comments:{hash_cache_key(None)}")
+    async def unset_comments(self, post_id: UUID) -> None:
+        pipe = self._cache.pipeline()
+        pipe.incr(f"posts:{post_id}:comments:generation")
+        pipe.expire(f"posts:{post_id}:comments:generation",
+                    CommentCache.GENERATION_EX)
+        await pipe.execute()
+        await self._local_caches.invalidate(
+            f"posts:{post_id}:comments:generation")
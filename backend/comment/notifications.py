@@ -23,7 +23,8 @@ class NewCommentOnPost(NewNotification):
                      "postByUsername": post_author_username,
                      "postId": post_id,
                      "commentPreview": f"{comment_content[:32]}..."
-                     if len(comment_content) > 32 else comment_content})
+                     if len(comment_content) > 32 else comment_content},
+            aggregate_by="postId")
 
 
 @singleton
@@ -8,6 +8,7 @@ from sqlalchemy import insert, select, desc
 from auth.models import profile
 from comment.cache import CommentCache
 from comment.models import Comment, comment
+from common.cache import SingleFlight, hash_cache_key
 from database.core import db
 from database.utils import map_to
 from post.repo import PostRepo
@@ -16,12 +17,24 @@ from post.repo import PostRepo
 @singleton
 class CommentRepo:
     @inject
-    def __init__(self, post_repo: PostRepo, cache: CommentCache):
+    def __init__(
+            self,
+            post_repo: PostRepo,
+            cache: CommentCache,
+            single_flight: SingleFlight):
         self._post_repo = post_repo
         self._cache = cache
+        self._single_flight = single_flight
 
-    @db.transaction()
     async def save_comment(self, new_comment: Comment) -> Comment:
+        saved_comment = await self._insert_comment(new_comment)
+        # bump the generation only once the comment is committed, so that
+        # pages filled from PostgreSQL before that are never served
+        await self._cache.unset_comments(new_comment.post_id)
+        return saved_comment
+
+    @db.transaction()
+    async def _insert_comment(self, new_comment: Comment) -> Comment:
         await self._post_repo.increment_comments_count(new_comment.post_id)
         saved_comment = await db.fetch_one(
             insert(comment)
@@ -30,7 +43,6 @@ class CommentRepo:
                 .returning(comment))
         saved_comment: Comment = map_to(saved_comment, Comment)
         saved_comment.username = new_comment.username
-        await self._cache.unset_latest_comments(new_comment.post_id)
         return saved_comment
 
     async def find_comments_by_post_id(
@@ -38,10 +50,28 @@ class CommentRepo:
             post_id: UUID,
             older_than: Optional[dt.datetime] = None,
             limit: int = 10) -> List[Comment]:
-        older_than_clause = older_than or dt.datetime.now(dt.timezone.utc)
-        if (comments := await self._cache.get_comments(post_id,
-                                                       older_than)) is not None:
+        generation, comments = await self._cache.get_comments(
+            post_id, older_than, limit)
+        if comments is not None:
             return comments
+
+        async def read_comments() -> Optional[List[Comment]]:
+            return (await self._cache.get_comments(
+                post_id, older_than, limit))[1]
+
+        return await self._single_flight.run(
+            f"posts:{post_id}:comments:{generation}:"
+            f"{hash_cache_key(older_than, limit)}",
+            lambda: self._fill_comments(post_id, older_than, limit, generation),
+            read=read_comments)
+
+    async def _fill_comments(
+            self,
+            post_id: UUID,
+            older_than: Optional[dt.datetime],
+            limit: int,
+            generation: int) -> List[Comment]:
+        older_than_clause = older_than or dt.datetime.now(dt.timezone.utc)
         comments = await db.fetch_all(
             select([comment, profile.c.username])
                 .where(comment.c.profile_id == profile.c.id)
@@ -49,7 +79,8 @@ class CommentRepo:
                 .where(comment.c.created_at < older_than_clause)
                 .order_by(desc(comment.c.created_at))
                 .limit(limit))
-        await self._cache.set_comments(comments, post_id, older_than)
+        await self._cache.set_comments(
+            comments, post_id, older_than, limit, generation)
         return comments
 
     async def find_comments_authors_by_post_id(self, post_id: UUID) \
@@ -0,0 +1,28 @@
+from typing import Dict
+
+from fastapi import Depends
+from fastapi_utils.cbv import cbv
+from fastapi_utils.inferring_router import InferringRouter
+
+from auth.models import User
+from auth.security import get_admin
+from common.cache import LocalCaches
+from common.injection import on
+from common.schemas import CacheMetricsRead
+
+cache_router = InferringRouter()
+
+
+@cbv(cache_router)
+class CacheApi:
+    _local_caches: LocalCaches = Depends(on(LocalCaches))
+
+    @cache_router.get(
+        "/cache/metrics",
+        response_model=Dict[str, CacheMetricsRead])
+    async def get_cache_metrics(
+            self,
+            admin: User = Depends(get_admin)):
+        """Get hits and misses of in-process and Redis cache tiers, by cache
+        name."""
+        return self._local_caches.metrics()
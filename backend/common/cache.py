@@ -1,13 +1,25 @@
+import asyncio
 import hashlib
 import json
+import time
+from asyncio import get_event_loop
+from collections import OrderedDict
 from functools import wraps
-from typing import Any
+from typing import Any, Dict, Callable, Awaitable, Optional, TypeVar, \
+    Tuple, Iterable
+from uuid import uuid4
 
 from fastapi.encoders import jsonable_encoder
+from injector import singleton, inject
+from pydantic import BaseModel
 
+from common.injection import Cache
 from common.log import logger
+from common.redis import RedisManager
 from config import cfg
 
+T = TypeVar("T")
+
 
 def fail_silently(default: Any = None):
     """Cache shouldn't make requests fail if cache backend is unavailable or not
@@ -34,3 +46,215 @@ def hash_cache_key(*args):
     """Generate a key from (hashable) parameters."""
     # cannot use hash(args) since hash function is not stable since Python 3.3
     return hashlib.md5(json.dumps(jsonable_encoder(args)).encode()).hexdigest()
+
+
+@singleton
+class SingleFlight:
+    """Coalesce concurrent fills of the same cache entry.
+
+    Concurrent callers in the same worker await a single fill, while a short
+    Redis lease lets a single worker run it: the other ones poll the cache
+    until the entry is populated, taking the lease over if it is released or
+    expires first."""
+    LEASE_EX_MS: int = 2000
+    POLL_INTERVAL: float = 0.05
+    RELEASE_LEASE_SCRIPT: str = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0"""
+
+    @inject
+    def __init__(self, cache: Cache):
+        self._cache = cache
+        self._flights: Dict[str, asyncio.Future] = {}
+
+    async def run(
+            self,
+            key: str,
+            fill: Callable[[], Awaitable[T]],
+            read: Optional[Callable[[], Awaitable[Optional[T]]]] = None) -> T:
+        """
+        Return the result of 'fill', sharing it among concurrent callers.
+
+        :param key: cache entry key
+        :param fill: reads from database and populates the cache entry
+        :param read: reads the cache entry, returning None if missing; when
+        not given, fills are coalesced within the worker only
+        """
+        if key not in self._flights:
+            flight = asyncio.ensure_future(self._fill(key, fill, read))
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+        # a cancelled caller must not cancel the fill awaited by the others
+        return await asyncio.shield(self._flights[key])
+
+    async def _fill(
+            self,
+            key: str,
+            fill: Callable[[], Awaitable[T]],
+            read: Optional[Callable[[], Awaitable[Optional[T]]]]) -> T:
+        if read is None:
+            return await fill()
+        token = uuid4().hex
+        while not await self._acquire_lease(key, token):
+            # another worker is filling the entry: take over once its lease is
+            # gone without the entry being populated (e.g. its fill failed, or
+            # the filled value wasn't cached)
+            while True:
+                await asyncio.sleep(SingleFlight.POLL_INTERVAL)
+                if (result := await read()) is not None:
+                    return result
+                if not await self._has_lease(key):
+                    if (result := await read()) is not None:
+                        return result
+                    break
+        try:
+            return await fill()
+        finally:
+            await self._release_lease(key, token)
+
+    @fail_silently(default=True)
+    async def _acquire_lease(self, key: str, token: str) -> bool:
+        return await self._cache.set(f"leases:{key}",
+                                     token,
+                                     pexpire=SingleFlight.LEASE_EX_MS,
+                                     exist=self._cache.SET_IF_NOT_EXIST)
+
+    @fail_silently(default=False)
+    async def _has_lease(self, key: str) -> bool:
+        return bool(await self._cache.exists(f"leases:{key}"))
+
+    @fail_silently()
+    async def _release_lease(self, key: str, token: str) -> None:
+        await self._cache.eval(SingleFlight.RELEASE_LEASE_SCRIPT,
+                               keys=[f"leases:{key}"],
+                               args=[token])
+
+
+class CacheMetrics(BaseModel):
+    local_hits: int = 0
+    local_misses: int = 0
+    redis_hits: int = 0
+    redis_misses: int = 0
+    local_hit_ratio: Optional[float]
+    redis_hit_ratio: Optional[float]
+
+
+class LocalCache:
+    """Bounded in-process cache in front of Redis, evicting least recently
+    used entries and expiring them after 'ttl' seconds.
+
+    Cached objects are shared by every caller, so they must not be modified.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._metrics = CacheMetrics()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self._metrics.local_misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._metrics.local_hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        if value is None:
+            return
+        self._entries[key] = (time.monotonic() + self._ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def record_redis_read(self, hit: bool) -> None:
+        if hit:
+            self._metrics.redis_hits += 1
+        else:
+            self._metrics.redis_misses += 1
+
+    def metrics(self) -> CacheMetrics:
+        ratio = lambda hits, misses: hits / (hits + misses) \
+            if hits + misses else None
+        return self._metrics.copy(update=dict(
+            local_hit_ratio=ratio(self._metrics.local_hits,
+                                  self._metrics.local_misses),
+            redis_hit_ratio=ratio(self._metrics.redis_hits,
+                                  self._metrics.redis_misses)))
+
+
+@singleton
+class LocalCaches:
+    """Registry of the in-process caches of this worker.
+
+    Keys unset by a worker are published on a Redis channel, so that every
+    worker drops them from its own in-process caches; entries also expire
+    after a short time, which bounds staleness if a message is lost."""
+    INVALIDATION_CHANNEL: str = "cache:invalidations"
+
+    @inject
+    def __init__(self, cache: Cache):
+        self._cache = cache
+        self._local_caches: Dict[str, LocalCache] = {}
+
+    def start(self):
+        get_event_loop().create_task(self._listen_for_invalidations())
+
+    def create(self, name: str) -> LocalCache:
+        """Create a named in-process cache."""
+        self._local_caches[name] = LocalCache(cfg.local_cache_max_size,
+                                              cfg.local_cache_ttl)
+        return self._local_caches[name]
+
+    async def invalidate(self, *keys: str) -> None:
+        """Drop keys from the in-process caches of every worker."""
+        if not keys:
+            return
+        self._delete(keys)
+        await self._cache.publish(LocalCaches.INVALIDATION_CHANNEL,
+                                  json.dumps(keys))
+
+    def metrics(self) -> Dict[str, CacheMetrics]:
+        """Return hits and misses of each cache tier, by cache name."""
+        return {name: local_cache.metrics()
+                for name, local_cache in self._local_caches.items()}
+
+    def _delete(self, keys: Iterable[str]) -> None:
+        for local_cache in self._local_caches.values():
+            local_cache.delete(*keys)
+
+    async def _listen_for_invalidations(self):
+        while True:
+            try:
+                await self._receive_invalidations()
+            except Exception as e:
+                logger.error("Cache invalidation subscription failed")
+            await asyncio.sleep(1)
+
+    async def _receive_invalidations(self):
+        # use a dedicated connection, since subscribed connections can't send
+        # other commands
+        subscriber = RedisManager(cfg.cache_uri)
+        await subscriber.start()
+        try:
+            channel, = await subscriber.redis.subscribe(
+                LocalCaches.INVALIDATION_CHANNEL)
+            # invalidations may have been missed while not subscribed
+            for local_cache in self._local_caches.values():
+                local_cache.clear()
+            async for message in channel.iter(encoding="utf-8"):
+                self._delete(json.loads(message))
+        finally:
+            subscriber.redis.close()
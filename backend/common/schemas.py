@@ -1,4 +1,5 @@
 import datetime as dt
+from typing import Optional
 
 from fastapi_camelcase import CamelModel
 
@@ -14,3 +15,12 @@ class BaseSchema(CamelModel):
         json_encoders = {
             dt.datetime: dt_to_iso8601z
         }
+
+
+class CacheMetricsRead(BaseSchema):
+    local_hits: int
+    local_misses: int
+    redis_hits: int
+    redis_misses: int
+    local_hit_ratio: Optional[float]
+    redis_hit_ratio: Optional[float]
@@ -25,6 +25,33 @@ class Settings(BaseSettings):
     jwt_expiration_seconds: int = timedelta(minutes=15).total_seconds()
     jwt_refresh_expiration_seconds: int = timedelta(weeks=2).total_seconds()
 
+    notifications_backend: str = "memory"
+    notifications_consumers: int = 4
+    notifications_queue_size: int = 10000
+    notifications_queue_policy: str = "drop"
+    # with the "block" policy, notifications parked beyond this are dropped
+    notifications_queue_max_parked: int = 10000
+    notifications_batch_size: int = 500
+    notifications_batch_timeout: float = 0.05
+    notifications_stream_claim_idle: float = 30
+    notifications_stream_max_deliveries: int = 5
+    notifications_aggregation: bool = True
+    notifications_partitions_ahead: int = 3
+    notifications_retention_months: int = 12
+    notifications_retention_policy: str = "drop"
+
+    presence_backend: str = "keys"
+    presence_tick: float = 1
+
+    # seconds during which further typing events from the same profile in the
+    # same chat group are dropped; clients hide the indicator after 4 seconds
+    chat_typing_throttle: float = 2
+    chat_read_receipts_flush_interval: float = 1
+
+    # in-process cache in front of Redis, per cache class
+    local_cache_max_size: int = 10000
+    local_cache_ttl: float = 5
+
     sentry_dsn: Optional[str] = None
 
 
@@ -0,0 +1,44 @@
+"""Notification default partition
+
+Revision ID: 7b3e5f1a9c60
+Revises: 0c6e2b9d4a13
+Create Date: 2026-10-17 16:08:23.541907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = '7b3e5f1a9c60'
+down_revision = '0c6e2b9d4a13'
+branch_labels = None
+depends_on = None
+
+COLUMNS = "id, created_at, profile_id, event_id, read, visited, aggregation_key, aggregation"
+
+
+def upgrade():
+    # catch notifications falling outside monthly partitions (e.g. when
+    # 'maintain_db.py' didn't run in time), which would otherwise be rejected
+    op.execute(text("CREATE TABLE notification_default PARTITION OF notification DEFAULT"))
+
+
+def downgrade():
+    # move notifications of the default partition to their monthly partitions
+    op.execute(text("ALTER TABLE notification DETACH PARTITION notification_default"))
+    op.execute(text("""
+    DO $$
+    DECLARE month timestamp;
+    BEGIN
+        FOR month IN SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')
+            FROM notification_default
+        LOOP
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF notification FOR VALUES FROM (%L) TO (%L)',
+                'notification_' || to_char(month, 'YYYY_MM'),
+                month AT TIME ZONE 'UTC',
+                (month + interval '1 month') AT TIME ZONE 'UTC');
+        END LOOP;
+    END $$"""))
+    op.execute(text(f"INSERT INTO notification ({COLUMNS}) SELECT {COLUMNS} FROM notification_default"))
+    op.drop_table('notification_default')
@@ -0,0 +1,58 @@
+"""Normalized notifications
+
+Revision ID: b7e2f4a61c90
+Revises: 5a1d3c7e9b21
+Create Date: 2026-10-17 11:02:19.604733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2f4a61c90'
+down_revision = '5a1d3c7e9b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('notification_event',
+    sa.Column('id', postgresql.UUID(), server_default=sa.text('uuid_generate_v4()'), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('data', postgresql.JSON(astext_type=sa.Text()), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.add_column('notification', sa.Column('event_id', postgresql.UUID(), nullable=True))
+    op.add_column('notification', sa.Column('aggregation', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+    # move existing payloads to events (one per notification, reusing its id)
+    # and aggregation state to the recipient row
+    op.execute(text("""
+    INSERT INTO notification_event (id, created_at, data)
+    SELECT id, created_at, data FROM notification"""))
+    op.execute(text("""
+    UPDATE notification SET event_id = id,
+        aggregation = CASE WHEN aggregation_key IS NOT NULL THEN json_build_object(
+            'actorsCount', data -> 'payload' -> 'actorsCount',
+            'latestActors', data -> 'payload' -> 'latestActors') END"""))
+    op.alter_column('notification', 'event_id', nullable=False)
+    op.create_foreign_key('notification_event_id_fkey', 'notification', 'notification_event', ['event_id'], ['id'], ondelete='CASCADE')
+    op.create_index(op.f('ix_notification_event_id'), 'notification', ['event_id'], unique=False)
+    op.drop_column('notification', 'data')
+
+
+def downgrade():
+    op.add_column('notification', sa.Column('data', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+    op.execute(text("""
+    UPDATE notification n SET data = json_build_object(
+        'event', e.data -> 'event',
+        'payload', (e.data -> 'payload')::jsonb
+            || COALESCE(n.aggregation::jsonb, '{}'::jsonb))
+    FROM notification_event e WHERE n.event_id = e.id"""))
+    op.alter_column('notification', 'data', nullable=False)
+    op.drop_index(op.f('ix_notification_event_id'), table_name='notification')
+    op.drop_constraint('notification_event_id_fkey', 'notification', type_='foreignkey')
+    op.drop_column('notification', 'aggregation')
+    op.drop_column('notification', 'event_id')
+    op.drop_table('notification_event')
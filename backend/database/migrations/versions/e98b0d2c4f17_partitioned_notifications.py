@@ -0,0 +1,89 @@
+"""Partitioned notifications
+
+Revision ID: e98b0d2c4f17
+Revises: d41c8a7f3e56
+Create Date: 2026-10-17 12:31:52.870214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'e98b0d2c4f17'
+down_revision = 'd41c8a7f3e56'
+branch_labels = None
+depends_on = None
+
+NOTIFICATION_INDEXES = [
+    ('ix_notification_created_at', ['created_at'], {}),
+    ('ix_notification_event_id', ['event_id'], {}),
+    ('ix_notification_unread_aggregation_key', ['profile_id', 'aggregation_key'], dict(postgresql_where=sa.text('read = false'))),
+    ('ix_notification_profile_id_created_at', ['profile_id', sa.text('created_at DESC')], {}),
+    ('ix_notification_profile_id_unread', ['profile_id'], dict(postgresql_where=sa.text('read = false'))),
+]
+COLUMNS = "id, created_at, profile_id, event_id, read, visited, aggregation_key, aggregation"
+
+
+def create_notification_table(primary_key, **kwargs):
+    op.create_table('notification',
+    sa.Column('id', postgresql.UUID(), server_default=sa.text('uuid_generate_v4()'), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('profile_id', postgresql.UUID(), nullable=False),
+    sa.Column('event_id', postgresql.UUID(), nullable=False),
+    sa.Column('read', sa.Boolean(), server_default='false', nullable=True),
+    sa.Column('visited', sa.Boolean(), server_default='false', nullable=True),
+    sa.Column('aggregation_key', sa.Text(), nullable=True),
+    sa.Column('aggregation', postgresql.JSON(astext_type=sa.Text()), nullable=True),
+    sa.ForeignKeyConstraint(['event_id'], ['notification_event.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['profile_id'], ['profile.id'], ondelete='CASCADE'),
+    primary_key,
+    **kwargs
+    )
+
+
+def replace_notification_table(primary_key, **kwargs):
+    # free index names, then recreate the table and move existing rows
+    for name, _, _ in NOTIFICATION_INDEXES:
+        op.drop_index(name, table_name='notification')
+    op.execute(text("ALTER TABLE notification RENAME CONSTRAINT notification_pkey TO notification_old_pkey"))
+    op.rename_table('notification', 'notification_old')
+    create_notification_table(primary_key, **kwargs)
+    for name, columns, index_kwargs in NOTIFICATION_INDEXES:
+        # partitioned tables only accept unique indexes including 'created_at'
+        unique = name == 'ix_notification_unread_aggregation_key' \
+            and 'postgresql_partition_by' not in kwargs
+        op.create_index(name, 'notification', columns, unique=unique, **index_kwargs)
+
+
+def upgrade():
+    replace_notification_table(
+        sa.PrimaryKeyConstraint('id', 'created_at'),
+        postgresql_partition_by='RANGE (created_at)')
+    # create monthly partitions (in UTC) covering existing notifications and
+    # the next months; later ones are created by 'maintain_db.py'
+    op.execute(text("""
+    DO $$
+    DECLARE month timestamp;
+    BEGIN
+        FOR month IN SELECT generate_series(
+            date_trunc('month', COALESCE((SELECT min(created_at) FROM notification_old), now()) AT TIME ZONE 'UTC'),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+            interval '1 month')
+        LOOP
+            EXECUTE format('CREATE TABLE %I PARTITION OF notification FOR VALUES FROM (%L) TO (%L)',
+                'notification_' || to_char(month, 'YYYY_MM'),
+                month AT TIME ZONE 'UTC',
+                (month + interval '1 month') AT TIME ZONE 'UTC');
+        END LOOP;
+    END $$"""))
+    op.execute(text(f"INSERT INTO notification ({COLUMNS}) SELECT {COLUMNS} FROM notification_old"))
+    op.drop_table('notification_old')
+
+
+def downgrade():
+    replace_notification_table(sa.PrimaryKeyConstraint('id'))
+    op.execute(text(f"INSERT INTO notification ({COLUMNS}) SELECT {COLUMNS} FROM notification_old"))
+    # dropping the partitioned table drops its partitions as well
+    op.drop_table('notification_old')
@@ -0,0 +1,121 @@
+import datetime as dt
+import re
+from typing import List
+
+import psycopg2
+
+from common.log import logger
+from config import cfg
+
+PARTITION_NAME = re.compile(r"^(?P<table>\w+)_(?P<year>\d{4})_(?P<month>\d{2})$")
+
+
+def add_months(month: dt.datetime, months: int) -> dt.datetime:
+    """Return the first day of the month 'months' after (or before) 'month'."""
+    year, month_index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return month.replace(year=year, month=month_index + 1, day=1)
+
+
+def partition_name(table: str, month: dt.datetime) -> str:
+    return f"{table}_{month.year:04d}_{month.month:02d}"
+
+
+def create_monthly_partition(cursor, table: str, month: dt.datetime) -> None:
+    """Create the partition of 'table' for 'month', moving its rows out of the
+    default partition (if any), which would otherwise prevent its creation."""
+    name = partition_name(table, month)
+    bounds = (month, add_months(month, 1))
+    cursor.execute("SELECT to_regclass(%s)", (f"{table}_default",))
+    if cursor.fetchone()[0] is None:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} "
+                       f"FOR VALUES FROM (%s) TO (%s)", bounds)
+        return
+    cursor.execute(f"CREATE TEMP TABLE {name}_moved (LIKE {table})")
+    cursor.execute(f"""WITH moved AS (
+        DELETE FROM {table}_default
+        WHERE created_at >= %s AND created_at < %s RETURNING *)
+    INSERT INTO {name}_moved SELECT * FROM moved""", bounds)
+    cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} "
+                   f"FOR VALUES FROM (%s) TO (%s)", bounds)
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {name}_moved")
+    cursor.execute(f"DROP TABLE {name}_moved")
+
+
+def maintain_monthly_partitions(
+        table: str,
+        months_ahead: int,
+        retention_months: int,
+        retention_policy: str = "drop") -> List[str]:
+    """
+    Create monthly range partitions of 'table' up to 'months_ahead' months from
+    now (taking over matching rows of its default partition) and detach (or
+    drop) partitions entirely older than 'retention_months'.
+
+    :param table: name of a table partitioned by range on 'created_at'
+    :param months_ahead: number of future monthly partitions to keep ready
+    :param retention_months: number of past months to retain
+    :param retention_policy: "drop" or "detach" expired partitions
+    :return: names of expired partitions
+    """
+    now = dt.datetime.now(dt.timezone.utc)
+    this_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    retention_start = add_months(this_month, -retention_months)
+    expired = []
+    connection = psycopg2.connect(f"postgresql://{cfg.postgres_uri}")
+    try:
+        with connection, connection.cursor() as cursor:
+            for months in range(months_ahead + 1):
+                month = add_months(this_month, months)
+                cursor.execute("SELECT to_regclass(%s)",
+                               (partition_name(table, month),))
+                if cursor.fetchone()[0] is None:
+                    create_monthly_partition(cursor, table, month)
+            cursor.execute(
+                """SELECT child.relname FROM pg_inherits
+                JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+                JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+                WHERE parent.relname = %s""", (table,))
+            for (name,) in cursor.fetchall():
+                match = PARTITION_NAME.match(name)
+                if not match or match["table"] != table:
+                    continue
+                month = this_month.replace(year=int(match["year"]),
+                                           month=int(match["month"]))
+                if add_months(month, 1) > retention_start:
+                    continue
+                cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                if retention_policy == "drop":
+                    cursor.execute(f"DROP TABLE {name}")
+                expired.append(name)
+    finally:
+        connection.close()
+    return expired
+
+
+def maintain_notification_partitions() -> None:
+    """Maintain 'notification' partitions according to retention settings and,
+    when expired partitions are dropped, delete events that are no longer
+    referenced by any notification."""
+    expired = maintain_monthly_partitions(
+        "notification",
+        months_ahead=cfg.notifications_partitions_ahead,
+        retention_months=cfg.notifications_retention_months,
+        retention_policy=cfg.notifications_retention_policy)
+    if expired:
+        logger.info(f"Expired notification partitions: {', '.join(expired)}")
+    # detached partitions keep referencing their events (deleting one would
+    # cascade to them), but aren't seen by the check below
+    if expired and cfg.notifications_retention_policy == "drop":
+        connection = psycopg2.connect(f"postgresql://{cfg.postgres_uri}")
+        try:
+            with connection, connection.cursor() as cursor:
+                cursor.execute("""DELETE FROM notification_event
+                WHERE created_at < %s AND NOT EXISTS (
+                    SELECT 1 FROM notification
+                    WHERE notification.event_id = notification_event.id)""",
+                               (add_months(
+                                   dt.datetime.now(dt.timezone.utc),
+                                   -cfg.notifications_retention_months),))
+        finally:
+            connection.close()
+
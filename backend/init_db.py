@@ -2,11 +2,13 @@ import alembic.config
 from neo4j import GraphDatabase
 
 from config import cfg
+from maintain_db import maintain_rdbms
 
 
 def init_rdbms():
     """Align database schema to latest version."""
     alembic.config.main(argv=["upgrade", "head"])
+    maintain_rdbms()
 
 
 def init_graph():
@@ -17,6 +17,8 @@ from chat.api import chat_router
 from chat.service import ChatService
 from comment.api import comment_router
 from common import injection
+from common.api import cache_router
+from common.cache import LocalCaches
 from common.exceptions import HTTPExceptionJSON
 from common.injection import injector, Cache
 from config import sentry_config, cfg
@@ -55,6 +57,7 @@ web_router.include_router(profiles_router, tags=["Profiles"])
 web_router.include_router(notification_router, tags=["Notifications"])
 web_router.include_router(chat_router, tags=["Chat"])
 web_router.include_router(avatar_router, tags=["Avatar"])
+web_router.include_router(cache_router, tags=["Cache"])
 injector.get(AvatarService)
 app.mount(
     "/web/avatars",
@@ -91,11 +94,15 @@ async def startup():
     await injection.configure()
     # Init API rate limiter
     await FastAPILimiter.init(injector.get(Cache))
+    # Listen for in-process caches invalidations
+    injector.get(LocalCaches).start()
     # Add Socket.IO routers
     ws = injector.get(WebSockets)
+    ws.store.start()
     ws.include_ws_router(injector.get(ChatService))
     ws.include_socketio(app, path="/ws")
     injector.get(NotificationManager).start()
+    injector.get(ChatService).start()
     injector.get(ChatService).subscribe_to_on_connect()
     injector.get(NotificationManager).subscribe_to_on_connect()
     # Connect to database
@@ -105,7 +112,11 @@ async def startup():
 # Shutdown event handler
 @app.on_event("shutdown")
 async def shutdown():
-    await db.disconnect()
+    # save buffered chat read marks before disconnecting from database
+    try:
+        await injector.get(ChatService).stop()
+    finally:
+        await db.disconnect()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+import datetime as dt
+
+import psycopg2
+
+from config import cfg
+from database.partitions import maintain_notification_partitions
+
+# stream entries are delivered again only while pending, i.e. for a few
+# claim periods: their records are kept way longer
+NOTIFICATION_STREAM_ENTRIES_RETENTION = dt.timedelta(days=1)
+
+
+def expire_notification_stream_entries():
+    """Delete records of Redis stream entries whose notifications were saved
+    long ago."""
+    connection = psycopg2.connect(f"postgresql://{cfg.postgres_uri}")
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM notification_stream_entry WHERE created_at < %s",
+                (dt.datetime.now(dt.timezone.utc)
+                 - NOTIFICATION_STREAM_ENTRIES_RETENTION,))
+    finally:
+        connection.close()
+
+
+def maintain_rdbms():
+    """Create upcoming table partitions and expire old ones; meant to be run
+    periodically (e.g. daily, through cron)."""
+    maintain_notification_partitions()
+    expire_notification_stream_entries()
+
+
+if __name__ == "__main__":
+    maintain_rdbms()
@@ -2,13 +2,17 @@ import datetime as dt
 from typing import List, Optional
 from uuid import UUID
 
-from fastapi import Query, Depends
+from fastapi import Query, Depends, Body, HTTPException, status
 from fastapi_utils.cbv import cbv
 from fastapi_utils.inferring_router import InferringRouter
 
+from auth.models import User
+from auth.security import get_admin, get_user
 from common.injection import on
 from common.rate_limiter import RateLimitTo
-from notification.schemas import NotificationRead
+from notification.manager import NotificationManager
+from notification.schemas import NotificationRead, \
+    NotificationQueueMetricsRead
 from notification.service import NotificationService
 
 notification_router = InferringRouter()
@@ -17,6 +21,7 @@ notification_router = InferringRouter()
 @cbv(notification_router)
 class NotificationApi:
     _service: NotificationService = Depends(on(NotificationService))
+    _manager: NotificationManager = Depends(on(NotificationManager))
 
     @notification_router.get(
         "/profiles/{profile_id}/notifications",
@@ -37,9 +42,28 @@ class NotificationApi:
         dependencies=[Depends(RateLimitTo(times=5, seconds=1))])
     async def patch_notifications(
             self,
-            notification_ids: List[UUID],
+            profile_id: UUID,
+            notification_ids: Optional[List[UUID]] = Body(None),
             read: Optional[bool] = Query(None),
-            visited: Optional[bool] = Query(None)):
-        """Mark specified notifications as read and/or visited."""
+            visited: Optional[bool] = Query(None),
+            up_to: Optional[dt.datetime] = Query(None),
+            user: User = Depends(get_user)):
+        """Mark specified notifications as read and/or visited; without
+        notification ids, mark every notification of the profile created up
+        to 'up_to' (default: now), returning only the changed ones."""
+        if profile_id != user.id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+        if notification_ids is None:
+            return await self._service.mark_profile_notifications_as(
+                profile_id, up_to, read, visited)
         return await self._service.mark_notifications_as(
             notification_ids, read, visited)
+
+    @notification_router.get(
+        "/notifications/metrics",
+        response_model=NotificationQueueMetricsRead)
+    async def get_notifications_metrics(
+            self,
+            admin: User = Depends(get_admin)):
+        """Get notification queue depth, drops and delivery latency."""
+        return await self._manager.metrics()
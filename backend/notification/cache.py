@@ -0,0 +1,51 @@
+import datetime as dt
+from typing import Optional, Dict
+from uuid import UUID
+
+from injector import singleton, inject
+
+from common.cache import fail_silently
+from common.injection import Cache
+
+
+@singleton
+class NotificationCache:
+    # counters are rebuilt from PostgreSQL when they expire, which periodically
+    # reconciles any drift caused by concurrent updates
+    UNREAD_COUNT_EX: int = int(dt.timedelta(minutes=10).total_seconds())
+    # increment a counter only if it is already materialized: a missing counter
+    # must be computed from scratch on next read
+    INCR_IF_EXISTS_SCRIPT: str = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return redis.call('INCRBY', KEYS[1], ARGV[1])
+    end
+    return nil"""
+
+    @inject
+    def __init__(self, cache: Cache):
+        self._cache = cache
+
+    @fail_silently()
+    async def get_unread_count(self, profile_id: UUID) -> Optional[int]:
+        count = await self._cache.get(
+            f"profiles:{profile_id}:unread_notifications")
+        return max(int(count), 0) if count is not None else None
+
+    @fail_silently()
+    async def set_unread_count(self, profile_id: UUID, count: int) -> None:
+        await self._cache.set(f"profiles:{profile_id}:unread_notifications",
+                              count,
+                              expire=NotificationCache.UNREAD_COUNT_EX)
+
+    @fail_silently()
+    async def alter_unread_counts(self, deltas: Dict[UUID, int]) -> None:
+        deltas = {profile_id: delta for profile_id, delta in deltas.items()
+                  if delta}
+        if not deltas:
+            return
+        pipe = self._cache.pipeline()
+        for profile_id, delta in deltas.items():
+            pipe.eval(NotificationCache.INCR_IF_EXISTS_SCRIPT,
+                      keys=[f"profiles:{profile_id}:unread_notifications"],
+                      args=[delta])
+        await pipe.execute()
@@ -1,6 +1,9 @@
+import asyncio
+import time
 from asyncio import Queue, QueueFull, get_event_loop
-from dataclasses import dataclass
-from typing import List, Dict, Union, Set
+from collections import defaultdict, deque
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Union, Set, Deque, Optional, Any
 from uuid import UUID
 
 from fastapi.encoders import jsonable_encoder
@@ -8,37 +11,82 @@ from injector import singleton, inject
 
 from auth.models import User
 from common.log import logger
-from notification.models import Notification, NotificationData
+from config import cfg
+from notification.models import Notification, NotificationData, \
+    NotificationQueueMetrics
+from notification.schemas import NotificationRead
 from notification.service import NotificationService
+from notification.stream import NotificationStream
 from pubsub.websocket import WebSockets
 
 
 class NewNotification:
-    """Base notification class; custom notification classes should extend it."""
+    """Base notification class; custom notification classes should extend it.
 
-    def __init__(self, event: str, payload: Dict):
+    When 'aggregate_by' names a payload field, notifications sharing event and
+    value of that field are collapsed into a single unread row per recipient,
+    which keeps track of actors count and latest actors: the payload of such
+    notifications must contain 'byId' and 'byUsername' fields."""
+
+    def __init__(
+            self,
+            event: str,
+            payload: Dict,
+            aggregate_by: Optional[str] = None):
         self.event = event
         self.payload = jsonable_encoder(payload)
+        self.aggregation_key = self.aggregation = None
+        if aggregate_by and cfg.notifications_aggregation:
+            self.aggregation_key = f"{event}:{self.payload[aggregate_by]}"
+            self.aggregation = {
+                "actorsCount": 1,
+                "latestActors": [{"id": self.payload["byId"],
+                                  "username": self.payload["byUsername"]}]}
 
 
 @singleton
 class NotificationManager:
+    LATENCY_SAMPLES: int = 1000
+
     @dataclass
     class QueueItem:
         event: str
         payload: Dict
         recipients: List[UUID]
+        aggregation_key: Optional[str] = None
+        aggregation: Optional[Dict] = None
+        enqueued_at: float = field(default_factory=time.time)
+        # id of the Redis stream entry carrying the item ("stream" backend)
+        entry_id: Optional[str] = None
 
     @inject
-    def __init__(self, ws: WebSockets, service: NotificationService):
+    def __init__(
+            self,
+            ws: WebSockets,
+            service: NotificationService,
+            stream: NotificationStream):
         self._ws = ws
         self._service = service
+        self._stream = stream
         # must postpone Queue creation to FastAPI startup event
         self._notification_queue = None
+        self._metrics = NotificationQueueMetrics(
+            queue_size=0,
+            queue_max_size=cfg.notifications_queue_size,
+            consumers=cfg.notifications_consumers)
+        self._latencies: Deque[float] = deque(
+            maxlen=NotificationManager.LATENCY_SAMPLES)
+        # notifications waiting for a queue slot
+        self._parked = 0
 
     def start(self):
-        self._notification_queue: Queue[NotificationManager.QueueItem] = Queue()
-        get_event_loop().create_task(self._listen_for_notifications())
+        if cfg.notifications_backend == "stream":
+            get_event_loop().create_task(self._start_stream_consumers())
+            return
+        self._notification_queue: Queue[NotificationManager.QueueItem] = Queue(
+            maxsize=cfg.notifications_queue_size)
+        for _ in range(cfg.notifications_consumers):
+            get_event_loop().create_task(self._listen_for_notifications())
 
     def subscribe_to_on_connect(self):
         self._ws.subscribe_to_on_connect(self._on_ws_connect)
@@ -50,40 +98,239 @@ class NotificationManager:
         """
         Create and send a new notification to recipients.
         Notifications dispatching is non-blocking and occurs asynchronously.
+        When the queue is full, the notification is either dropped or parked
+        until a slot frees up, depending on 'notifications_queue_policy'
+        (up to 'notifications_queue_max_parked' parked notifications).
+        With the "stream" backend, notifications are appended to a Redis stream
+        shared by all workers instead.
 
         :param notification: notification to be sent
         :param recipients: profiles that will receive the notification
         """
         if not recipients:
             return
+        item = NotificationManager.QueueItem(
+            event=notification.event,
+            payload=notification.payload,
+            recipients=recipients,
+            aggregation_key=notification.aggregation_key,
+            aggregation=notification.aggregation)
+        if cfg.notifications_backend == "stream":
+            get_event_loop().create_task(self._add_to_stream(item))
+            return
         try:
-            self._notification_queue.put_nowait(NotificationManager.QueueItem(
-                event=notification.event,
-                payload=notification.payload,
-                recipients=recipients))
+            self._notification_queue.put_nowait(item)
         except QueueFull:
-            logger.error("Notification queue is full")
-            pass
+            if cfg.notifications_queue_policy == "block" and \
+                    self._parked < cfg.notifications_queue_max_parked:
+                self._metrics.blocked += 1
+                self._parked += 1
+                get_event_loop().create_task(self._park(item))
+            else:
+                self._metrics.dropped += 1
+                logger.error("Notification queue is full")
+                return
+        self._metrics.enqueued += 1
 
-    async def _on_ws_connect(self, sid: str, user: User):
+    async def metrics(self) -> NotificationQueueMetrics:
+        """Return a snapshot of notification queue metrics (with the "stream"
+        backend, queue size is the number of unacknowledged entries)."""
+        latencies = sorted(self._latencies)
+        percentile = lambda p: latencies[int(p * (len(latencies) - 1))] \
+            if latencies else None
+        if cfg.notifications_backend == "stream":
+            queue_size = await self._stream.pending_count()
+        else:
+            queue_size = self._notification_queue.qsize() \
+                if self._notification_queue else 0
+        return self._metrics.copy(update=dict(
+            queue_size=queue_size,
+            parked=self._parked,
+            latency_p50_ms=percentile(0.5),
+            latency_p95_ms=percentile(0.95),
+            latency_max_ms=latencies[-1] if latencies else None))
+
+    async def _on_ws_connect(self, sid: str, user: User) -> Dict[str, Any]:
         count = await self._service.count_unread_notifications_by_profile_id(
             user.id)
-        await self._ws.send("unread_notifications_count", count, to=sid)
+        return {"unread_notifications_count": count}
+
+    async def _park(self, item: "NotificationManager.QueueItem"):
+        try:
+            await self._notification_queue.put(item)
+        finally:
+            self._parked -= 1
 
     async def _listen_for_notifications(self):
         while True:
-            notification = await self._notification_queue.get()
-            for recipient in notification.recipients:
-                try:
-                    await self._service.create_notification(
-                        Notification(
-                            profile_id=recipient,
-                            data=NotificationData(
-                                event=notification.event,
-                                payload=notification.payload)))
-                    await self._ws.send(
-                        event="new_unread_notification",
-                        payload=1,
-                        to=recipient)
-                except Exception as e:
-                    logger.error("Notification creation failed")
+            await self._deliver_and_track(await self._next_batch())
+
+    async def _add_to_stream(self, item: "NotificationManager.QueueItem"):
+        try:
+            await self._stream.add(jsonable_encoder(asdict(item)))
+            self._metrics.enqueued += 1
+        except Exception as e:
+            self._metrics.dropped += 1
+            logger.error("Notification stream append failed")
+
+    async def _start_stream_consumers(self):
+        await self._stream.start()
+        for _ in range(cfg.notifications_consumers):
+            get_event_loop().create_task(
+                self._listen_for_stream_notifications())
+        get_event_loop().create_task(self._reclaim_stream_notifications())
+
+    async def _listen_for_stream_notifications(self):
+        while True:
+            try:
+                await self._receive_stream_notifications()
+            except Exception as e:
+                logger.error("Notification stream read failed")
+            await asyncio.sleep(1)
+
+    async def _receive_stream_notifications(self):
+        # the dedicated connection doesn't reconnect: open a new one after a
+        # failure
+        reader = await self._stream.connect()
+        try:
+            while True:
+                entries = await self._stream.read(
+                    reader,
+                    count=cfg.notifications_batch_size,
+                    timeout=cfg.notifications_stream_claim_idle / 2)
+                await self._deliver_stream_entries(entries)
+        finally:
+            reader.close()
+
+    async def _reclaim_stream_notifications(self):
+        # retry entries left pending by failed deliveries or dead workers
+        while True:
+            await asyncio.sleep(cfg.notifications_stream_claim_idle)
+            try:
+                entries, dead_lettered = await self._stream.claim_stale(
+                    min_idle=cfg.notifications_stream_claim_idle,
+                    max_deliveries=cfg.notifications_stream_max_deliveries,
+                    count=cfg.notifications_batch_size)
+            except Exception as e:
+                logger.error("Notification stream claim failed")
+                continue
+            self._metrics.dead_lettered += dead_lettered
+            await self._deliver_stream_entries(entries)
+
+    async def _deliver_stream_entries(self, entries):
+        if not entries:
+            return
+        batch = [NotificationManager.QueueItem(**{**item, "entry_id": entry_id})
+                 for entry_id, item in entries]
+        delivered = await self._deliver_and_track(batch)
+        # entries that failed stay pending, to be retried and eventually
+        # dead-lettered on their own
+        try:
+            await self._stream.ack([entry_id for (entry_id, _), item_delivered
+                                    in zip(entries, delivered)
+                                    if item_delivered])
+        except Exception as e:
+            logger.error("Notification stream ack failed")
+
+    async def _deliver_and_track(
+            self, batch: List["NotificationManager.QueueItem"]) -> List[bool]:
+        """Save a batch of notifications, which is done in a single
+        transaction: if it fails, save its items one by one so that a faulty
+        item doesn't take the others down with it. New notifications are then
+        sent to recipients, whether or not sending succeeds.
+
+        :return: whether each item of the batch was saved
+        """
+        if (created := await self._try_save(batch)) is not None:
+            saved = [True] * len(batch)
+        elif len(batch) == 1:
+            saved, created = [False], []
+        else:
+            results = [await self._try_save([item]) for item in batch]
+            saved = [result is not None for result in results]
+            created = [n for result in results if result for n in result]
+        self._metrics.delivered += saved.count(True)
+        self._metrics.failed += saved.count(False)
+        if not all(saved):
+            logger.error(f"Notification creation failed for "
+                         f"{saved.count(False)} of {len(batch)} items")
+        await self._send(created)
+        delivered_at = time.time()
+        self._latencies.extend(
+            (delivered_at - item.enqueued_at) * 1000
+            for item, item_saved in zip(batch, saved) if item_saved)
+        return saved
+
+    async def _try_save(self, batch: List["NotificationManager.QueueItem"]) \
+            -> Optional[List[Notification]]:
+        try:
+            return await self._save(batch)
+        except Exception as e:
+            return None
+
+    async def _next_batch(self) -> List["NotificationManager.QueueItem"]:
+        # wait for the first notification, then keep draining the queue until
+        # either the batch is full (counting one row per recipient) or the
+        # batch timeout expires
+        loop = get_event_loop()
+        batch = [await self._notification_queue.get()]
+        size = len(batch[0].recipients)
+        deadline = loop.time() + cfg.notifications_batch_timeout
+        while size < cfg.notifications_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(
+                    self._notification_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item.recipients)
+        return batch
+
+    async def _save(self, batch: List["NotificationManager.QueueItem"]) \
+            -> List[Notification]:
+        """Save a batch of notifications, returning the new ones."""
+        notifications = [[
+            Notification(
+                profile_id=recipient,
+                data=NotificationData(
+                    event=item.event,
+                    payload=item.payload),
+                aggregation_key=item.aggregation_key,
+                aggregation=item.aggregation)
+            for recipient in item.recipients] for item in batch]
+        if batch[0].entry_id is not None:
+            # stream entries may be delivered more than once (e.g. when their
+            # acknowledgement fails): save each entry's notifications once
+            created, _ = await self._service.create_stream_notifications({
+                item.entry_id: item_notifications
+                for item, item_notifications in zip(batch, notifications)})
+        else:
+            created, _ = await self._service.create_notifications(
+                [n for item_notifications in notifications
+                 for n in item_notifications])
+        return created
+
+    async def _send(self, created: List[Notification]):
+        # one event per recipient, carrying its new notifications so that
+        # clients can render them without fetching (notifications aggregated
+        # into an unread row are not new); concurrent emits are pipelined on
+        # the Socket.IO Redis connection
+        new_notifications: Dict[UUID, List[NotificationRead]] = \
+            defaultdict(list)
+        for n in created:
+            new_notifications[n.profile_id].append(
+                NotificationRead(**n.dict()))
+        # notifications are already saved: a failed emit must not fail them
+        results = await asyncio.gather(
+            *[self._ws.send(event="new_unread_notification",
+                            payload=notifications,
+                            to=recipient)
+              for recipient, notifications in new_notifications.items()],
+            return_exceptions=True)
+        if failures := sum(isinstance(result, Exception)
+                           for result in results):
+            logger.error(f"New notifications sending failed for {failures} "
+                         f"recipients")
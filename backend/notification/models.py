@@ -3,23 +3,67 @@ from typing import Optional, Dict
 from uuid import UUID
 
 from pydantic import BaseModel
-from sqlalchemy import Column, Table, ForeignKey, Boolean
+from sqlalchemy import Column, Table, ForeignKey, Boolean, Text, Index, text, \
+    desc, DateTime, func
 from sqlalchemy.dialects.postgresql import JSON
 
 from database.core import metadata
 from database.utils import uuid_pk, created_at, PgUUID
 
+# event payload, stored once and shared by all its recipients
+notification_event = Table(
+    "notification_event", metadata,
+    uuid_pk(),
+    created_at(),
+    Column("data", JSON, nullable=False)
+)
+
+# per-recipient notification state, partitioned by month of creation (primary
+# key must include the partition key)
 notification = Table(
     "notification", metadata,
-    uuid_pk(),
-    created_at(index=True),
+    Column("id",
+           PgUUID,
+           primary_key=True,
+           server_default=text("uuid_generate_v4()")),
+    Column("created_at",
+           DateTime(timezone=True),
+           primary_key=True,
+           server_default=func.now(),
+           index=True),
     Column("profile_id", PgUUID,
            ForeignKey("profile.id", ondelete="CASCADE"),
            nullable=False),
-    Column("data", JSON, nullable=False),
+    Column("event_id", PgUUID,
+           ForeignKey("notification_event.id", ondelete="CASCADE"),
+           nullable=False,
+           index=True),
     Column("read", Boolean, server_default="false"),
-    Column("visited", Boolean, server_default="false")
+    Column("visited", Boolean, server_default="false"),
+    # notifications sharing the same aggregation key are collapsed into a
+    # single unread row per recipient, whose aggregation state (actors count
+    # and latest actors) is merged into the event payload when read
+    Column("aggregation_key", Text, nullable=True),
+    Column("aggregation", JSON, nullable=True),
+    Index("ix_notification_unread_aggregation_key",
+          "profile_id", "aggregation_key",
+          postgresql_where=text("read = false")),
+    postgresql_partition_by="RANGE (created_at)"
 )
+# Redis stream entries whose notifications were saved: entries delivered again
+# (e.g. after a failed acknowledgement) are skipped
+notification_stream_entry = Table(
+    "notification_stream_entry", metadata,
+    Column("id", Text, primary_key=True),
+    created_at(index=True)
+)
+
+# serve paginated notifications of a profile and unread notifications count
+Index("ix_notification_profile_id_created_at",
+      notification.c.profile_id, desc(notification.c.created_at))
+Index("ix_notification_profile_id_unread",
+      notification.c.profile_id,
+      postgresql_where=text("read = false"))
 
 
 class NotificationData(BaseModel):
@@ -34,3 +78,22 @@ class Notification(BaseModel):
     data: NotificationData
     read: bool = False
     visited: bool = False
+    event_id: Optional[UUID]
+    aggregation_key: Optional[str]
+    aggregation: Optional[Dict]
+
+
+class NotificationQueueMetrics(BaseModel):
+    queue_size: int
+    queue_max_size: int
+    parked: int = 0
+    consumers: int
+    enqueued: int = 0
+    delivered: int = 0
+    dropped: int = 0
+    blocked: int = 0
+    failed: int = 0
+    dead_lettered: int = 0
+    latency_p50_ms: Optional[float]
+    latency_p95_ms: Optional[float]
+    latency_max_ms: Optional[float]
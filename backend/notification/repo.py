@@ -1,59 +1,333 @@
 import datetime as dt
-from typing import List, Optional
-from uuid import UUID
+import json
+from collections import Counter
+from typing import List, Optional, Tuple, Dict, Mapping, Set
+from uuid import UUID, uuid4
 
-from injector import singleton
-from sqlalchemy import insert, select, update, literal, func, desc
+from fastapi.encoders import jsonable_encoder
+from injector import singleton, inject
+from sqlalchemy import insert, select, update, literal, func, desc, \
+    delete, exists, tuple_, text, or_
 
 from database.core import db
-from database.utils import map_result
-from notification.models import Notification, notification
+from database.utils import map_to
+from notification.cache import NotificationCache
+from notification.models import Notification, notification, \
+    notification_event
 
 
 @singleton
 class NotificationRepo:
-    @map_result
+    MAX_LATEST_ACTORS: int = 3
+    # "up to" cursors come from serialized notifications, which are truncated
+    # to milliseconds: include every row falling within the last millisecond
+    UP_TO_PRECISION: dt.timedelta = dt.timedelta(milliseconds=1)
+    # merge incoming aggregable notifications into the existing unread ones:
+    # the new actor is moved to the head of the (deduplicated) latest actors
+    # and counted if it wasn't already among them; an upsert can't be used since
+    # unique indexes of a partitioned table must include the partition key
+    AGGREGATED_UPDATE_SQL: str = f"""
+    UPDATE notification SET
+        event_id = incoming.event_id,
+        aggregation = json_build_object(
+            'actorsCount',
+            (notification.aggregation ->> 'actorsCount')::int
+            + CASE WHEN (notification.aggregation -> 'latestActors')::jsonb
+                @> jsonb_build_array(jsonb_build_object(
+                    'id', incoming.aggregation -> 'latestActors' -> 0 -> 'id'))
+              THEN 0 ELSE 1 END,
+            'latestActors', (
+                SELECT jsonb_agg(actor ORDER BY position) FROM (
+                    SELECT actor, position FROM jsonb_array_elements(
+                        (incoming.aggregation -> 'latestActors')::jsonb
+                        || (notification.aggregation -> 'latestActors')::jsonb)
+                        WITH ORDINALITY AS actors(actor, position)
+                    WHERE position = 1
+                        OR (actor ->> 'id')
+                        != (incoming.aggregation -> 'latestActors' -> 0 ->> 'id')
+                    ORDER BY position
+                    LIMIT {MAX_LATEST_ACTORS}) latest_actors)),
+        created_at = COALESCE(incoming.created_at, now()),
+        visited = false
+    FROM json_to_recordset(CAST(:rows AS json)) AS incoming(
+        profile_id uuid, aggregation_key text, event_id uuid, aggregation json,
+        created_at timestamptz)
+    WHERE notification.profile_id = incoming.profile_id
+        AND notification.aggregation_key = incoming.aggregation_key
+        AND notification.read = false
+    RETURNING {", ".join(f"notification.{column.name}"
+                         for column in notification.columns)}"""
+
+    @inject
+    def __init__(self, cache: NotificationCache):
+        self._cache = cache
+
     async def save_notification(self, new_notification: Notification) \
             -> Notification:
-        return await db.fetch_one(
+        return (await self.save_notifications([new_notification]))[0]
+
+    async def save_notifications(
+            self, new_notifications: List[Notification]) -> List[Notification]:
+        saved_notifications = await self.insert_notifications(
+            new_notifications)
+        await self.increment_unread_counts(saved_notifications)
+        return saved_notifications
+
+    @db.transaction()
+    async def insert_notifications(
+            self, new_notifications: List[Notification]) -> List[Notification]:
+        """Save notifications without updating unread counters, which must be
+        incremented once the outermost transaction is committed."""
+        if not new_notifications:
+            return []
+        events = await self._save_events(new_notifications)
+        results = await db.fetch_all(
             insert(notification)
-                .values(new_notification.dict(exclude_none=True))
+                .values([self._recipient_values(n, events)
+                         for n in new_notifications])
                 .returning(notification))
+        return self._map_notifications(results, events)
+
+    async def save_aggregated_notifications(
+            self, new_notifications: List[Notification]) \
+            -> Tuple[List[Notification], List[Notification]]:
+        created, aggregated = await self.insert_aggregated_notifications(
+            new_notifications)
+        await self.increment_unread_counts(created)
+        return created, aggregated
+
+    @db.transaction()
+    async def insert_aggregated_notifications(
+            self, new_notifications: List[Notification]) \
+            -> Tuple[List[Notification], List[Notification]]:
+        """Save aggregable notifications without updating unread counters,
+        which must be incremented once the outermost transaction is
+        committed."""
+        if not new_notifications:
+            return [], []
+        created, aggregated = [], []
+        events = await self._save_events(new_notifications)
+        previous_event_ids = [result["event_id"] for result in
+                              await db.fetch_all(
+                                  select([notification.c.event_id])
+                                      .where(notification.c.read == False)
+                                      .where(tuple_(
+                                      notification.c.profile_id,
+                                      notification.c.aggregation_key).in_(
+                                      [(n.profile_id, n.aggregation_key)
+                                       for n in new_notifications])))]
+        # serialize concurrent aggregations on the same recipient and key,
+        # taking locks in a consistent order to prevent deadlocks
+        await db.execute(
+            query="""SELECT pg_advisory_xact_lock(hashtext(key))
+            FROM unnest(CAST(:keys AS text[])) key ORDER BY key""",
+            values=dict(keys=sorted({f"{n.profile_id}:{n.aggregation_key}"
+                                     for n in new_notifications})))
+        # a single update can't merge two notifications into the same row:
+        # notifications sharing recipient and aggregation key are split across
+        # successive statements
+        rounds: List[dict] = []
+        for n in new_notifications:
+            key = (str(n.profile_id), n.aggregation_key)
+            update_round = next((r for r in rounds if key not in r), None)
+            if update_round is None:
+                update_round = {}
+                rounds.append(update_round)
+            update_round[key] = self._recipient_values(n, events)
+        for update_round in rounds:
+            updated = await db.fetch_all(
+                text(NotificationRepo.AGGREGATED_UPDATE_SQL)
+                    .bindparams(rows=json.dumps(
+                    jsonable_encoder(list(update_round.values()))))
+                    .columns(*notification.columns))
+            updated_keys = {(str(result["profile_id"]),
+                             result["aggregation_key"]) for result in updated}
+            new_values = [values for key, values in update_round.items()
+                          if key not in updated_keys]
+            inserted = await db.fetch_all(
+                insert(notification)
+                    .values(new_values)
+                    .returning(notification)) if new_values else []
+            aggregated += self._map_notifications(updated, events)
+            created += self._map_notifications(inserted, events)
+        # aggregated rows now point to the latest event: drop the events that
+        # are no longer referenced by any recipient
+        if previous_event_ids:
+            await db.execute(
+                delete(notification_event)
+                    .where(notification_event.c.id.in_(
+                    [literal(event_id) for event_id in previous_event_ids]))
+                    .where(~exists().where(
+                    notification.c.event_id == notification_event.c.id)))
+        return created, aggregated
+
+    async def increment_unread_counts(
+            self, new_notifications: List[Notification]) -> None:
+        await self._cache.alter_unread_counts(Counter(
+            n.profile_id for n in new_notifications if not n.read))
+
+    async def save_stream_entries(self, entry_ids: List[str]) -> Set[str]:
+        """Record stream entries whose notifications are about to be saved,
+        returning the ones that weren't already recorded."""
+        if not entry_ids:
+            return set()
+        # a concurrent delivery of the same entry waits for this transaction
+        # and then records nothing
+        results = await db.fetch_all(
+            query="""INSERT INTO notification_stream_entry (id)
+            SELECT unnest(CAST(:ids AS text[]))
+            ON CONFLICT DO NOTHING RETURNING id""",
+            values=dict(ids=entry_ids))
+        return {result["id"] for result in results}
 
-    @map_result
     async def find_notifications_by_profile_id(
             self,
             profile_id: UUID,
             older_than: Optional[dt.datetime] = None,
             limit: int = 10) -> List[Notification]:
-        older_than = older_than or dt.datetime.now(dt.timezone.utc)
-        return await db.fetch_all(
-            select([notification])
-                .where(notification.c.profile_id == profile_id)
-                .where(notification.c.created_at < older_than)
-                .order_by(desc(notification.c.created_at))
-                .limit(limit))
+        return self._map_notifications(await db.fetch_all(
+            self._find_notifications_by_profile_id_query(
+                profile_id, older_than, limit)))
 
-    @map_result
     async def count_unread_notifications_by_profile_id(self, profile_id: UUID) \
             -> int:
-        return await db.fetch_val(
-            select([func.count()])
-                .where(notification.c.profile_id == profile_id)
-                .where(notification.c.read == False))
+        if (count := await self._cache.get_unread_count(profile_id)) \
+                is not None:
+            return count
+        count = await db.fetch_val(
+            self._count_unread_notifications_by_profile_id_query(profile_id))
+        await self._cache.set_unread_count(profile_id, count)
+        return count
 
-    @map_result
     async def update_notifications_read_visited_status(
             self,
             notification_ids: List[UUID],
             read: Optional[bool] = None,
             visited: Optional[bool] = None) -> List[Notification]:
-        return await db.fetch_all(
+        # join the updated rows with their previous state to keep track of how
+        # many notifications switched between read and unread
+        previous = select([notification.c.id, notification.c.read]) \
+            .where(notification.c.id.in_([literal(n)
+                                          for n in notification_ids])) \
+            .alias("previous")
+        results = await db.fetch_all(
             update(notification)
-                .where(notification.c.id.in_([literal(n)
-                                              for n in notification_ids]))
+                .where(notification.c.id == previous.c.id)
+                .where(notification.c.event_id == notification_event.c.id)
                 .values(**(dict(read=read)
                            if read is not None else {}),
                         **(dict(visited=visited)
                            if visited is not None else {}))
-                .returning(notification))
+                .returning(notification,
+                           notification_event.c.data,
+                           previous.c.read.label("was_read")))
+        unread_deltas = Counter()
+        for result in results:
+            unread_deltas[result["profile_id"]] += \
+                int(not result["read"]) - int(not result["was_read"])
+        await self._cache.alter_unread_counts(unread_deltas)
+        return self._map_notifications(results)
+
+    async def update_notifications_read_visited_status_up_to(
+            self,
+            profile_id: UUID,
+            up_to: dt.datetime,
+            read: Optional[bool] = None,
+            visited: Optional[bool] = None) -> List[Notification]:
+        # only touch rows whose status actually changes: marking everything as
+        # read filters on 'read = false', served by the partial unread index
+        changed = [*([notification.c.read == (not read)]
+                     if read is not None else []),
+                   *([notification.c.visited == (not visited)]
+                     if visited is not None else [])]
+        if not changed:
+            return []
+        results = await db.fetch_all(
+            update(notification)
+                .where(notification.c.profile_id == profile_id)
+                .where(notification.c.created_at
+                       < up_to + NotificationRepo.UP_TO_PRECISION)
+                .where(or_(*changed))
+                .where(notification.c.event_id == notification_event.c.id)
+                .values(**(dict(read=read)
+                           if read is not None else {}),
+                        **(dict(visited=visited)
+                           if visited is not None else {}))
+                .returning(notification, notification_event.c.data))
+        if read is not None and results:
+            # rebuild the counter rather than tracking previous read states
+            # (an index-only count over the remaining unread rows)
+            await self._cache.set_unread_count(profile_id, await db.fetch_val(
+                self._count_unread_notifications_by_profile_id_query(
+                    profile_id)))
+        return self._map_notifications(results)
+
+    @staticmethod
+    def _find_notifications_by_profile_id_query(
+            profile_id: UUID,
+            older_than: Optional[dt.datetime] = None,
+            limit: int = 10):
+        older_than = older_than or dt.datetime.now(dt.timezone.utc)
+        return select([notification, notification_event.c.data]) \
+            .where(notification.c.event_id == notification_event.c.id) \
+            .where(notification.c.profile_id == profile_id) \
+            .where(notification.c.created_at < older_than) \
+            .order_by(desc(notification.c.created_at)) \
+            .limit(limit)
+
+    @staticmethod
+    def _count_unread_notifications_by_profile_id_query(profile_id: UUID):
+        return select([func.count()]) \
+            .where(notification.c.profile_id == profile_id) \
+            .where(notification.c.read == False)
+
+    async def _save_events(self, new_notifications: List[Notification]) \
+            -> Dict[str, Dict]:
+        """Save every distinct notification payload once, returning saved
+        events by payload."""
+        events = {}
+        for n in new_notifications:
+            events.setdefault(self._event_key(n), dict(
+                id=str(uuid4()), data=jsonable_encoder(n.data)))
+        await db.execute(insert(notification_event)
+                         .values(list(events.values())))
+        return events
+
+    def _recipient_values(
+            self,
+            new_notification: Notification,
+            events: Dict[str, Dict]) -> Dict:
+        return dict(profile_id=new_notification.profile_id,
+                    event_id=events[self._event_key(new_notification)]["id"],
+                    read=new_notification.read,
+                    visited=new_notification.visited,
+                    aggregation_key=new_notification.aggregation_key,
+                    aggregation=new_notification.aggregation,
+                    **(dict(created_at=new_notification.created_at)
+                       if new_notification.created_at else {}))
+
+    @staticmethod
+    def _event_key(new_notification: Notification) -> str:
+        return json.dumps(jsonable_encoder(new_notification.data),
+                          sort_keys=True)
+
+    @staticmethod
+    def _map_notifications(
+            results: List[Mapping],
+            events: Optional[Dict[str, Dict]] = None) -> List[Notification]:
+        """Map recipient rows to notifications, merging aggregation state into
+        the event payload (taken from the row itself if not provided)."""
+        # asyncpg returns event ids as UUID objects, while saved events are
+        # keyed by their string representation
+        events_data = {event["id"]: event["data"]
+                       for event in (events or {}).values()}
+        notifications = []
+        for result in results:
+            data = events_data[str(result["event_id"])] if events \
+                else result["data"]
+            notifications.append(map_to({
+                **result,
+                "data": {**data, "payload": {**data["payload"],
+                                             **(result["aggregation"] or {})}}
+            }, Notification))
+        return notifications
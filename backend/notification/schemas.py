@@ -22,3 +22,19 @@ class NotificationRead(BaseSchema):
 class NotificationCreate(BaseSchema):
     profile_id: UUID
     data: NotificationReadData
+
+
+class NotificationQueueMetricsRead(BaseSchema):
+    queue_size: int
+    queue_max_size: int
+    parked: int
+    consumers: int
+    enqueued: int
+    delivered: int
+    dropped: int
+    blocked: int
+    failed: int
+    dead_lettered: int
+    latency_p50_ms: Optional[float]
+    latency_p95_ms: Optional[float]
+    latency_max_ms: Optional[float]
@@ -1,24 +1,55 @@
 import datetime as dt
-from typing import Optional, List
+from collections import Counter
+from typing import Optional, List, Tuple, Dict
 from uuid import UUID
 
 from injector import singleton, inject
 
+from database.core import db
 from notification.models import Notification
 from notification.repo import NotificationRepo
+from pubsub.websocket import WebSockets
 
 
 @singleton
 class NotificationService:
     @inject
-    def __init__(self, repo: NotificationRepo):
+    def __init__(self, repo: NotificationRepo, ws: WebSockets):
         self._repo = repo
+        self._ws = ws
 
     async def create_notification(
             self, new_notification: Notification) -> Notification:
         """Save a new notification."""
         return await self._repo.save_notification(new_notification)
 
+    async def create_notifications(
+            self, new_notifications: List[Notification]) \
+            -> Tuple[List[Notification], List[Notification]]:
+        """Save many notifications with multi-row statements, collapsing
+        aggregable notifications into existing unread ones; either all of them
+        are saved or none is.
+
+        :return: newly created notifications, updated aggregated notifications
+        """
+        created, aggregated = await self._save_notifications(new_notifications)
+        # only once committed, so that rolled back notifications aren't counted
+        await self._repo.increment_unread_counts(created)
+        return created, aggregated
+
+    async def create_stream_notifications(
+            self, entries: Dict[str, List[Notification]]) \
+            -> Tuple[List[Notification], List[Notification]]:
+        """Save notifications of Redis stream entries, skipping entries whose
+        notifications were already saved.
+
+        :param entries: notifications by stream entry id
+        :return: newly created notifications, updated aggregated notifications
+        """
+        created, aggregated = await self._save_stream_notifications(entries)
+        await self._repo.increment_unread_counts(created)
+        return created, aggregated
+
     async def find_notifications_by_profile_id(
             self,
             profile_id: UUID,
@@ -47,3 +78,55 @@ class NotificationService:
             notification_ids=notification_ids,
             read=read,
             visited=visited)
+
+    async def mark_profile_notifications_as(
+            self,
+            profile_id: UUID,
+            up_to: Optional[dt.datetime] = None,
+            read: Optional[bool] = None,
+            visited: Optional[bool] = None) -> List[Notification]:
+        """Mark every notification of a profile created up to 'up_to'
+        (default: now) as read and/or visited, then push the resulting unread
+        notifications count to the profile."""
+        updated = \
+            await self._repo.update_notifications_read_visited_status_up_to(
+                profile_id=profile_id,
+                up_to=up_to or dt.datetime.now(dt.timezone.utc),
+                read=read,
+                visited=visited)
+        if read is not None and updated:
+            count = await self._repo.count_unread_notifications_by_profile_id(
+                profile_id)
+            await self._ws.send("unread_notifications_count",
+                                count,
+                                to=profile_id)
+        return updated
+
+    @db.transaction()
+    async def _save_notifications(
+            self, new_notifications: List[Notification]) \
+            -> Tuple[List[Notification], List[Notification]]:
+        # rows saved by a transaction share its timestamp: space notifications
+        # of the same recipient by a millisecond (the precision of pagination
+        # cursors), latest last, so that pages don't skip any of them
+        now = dt.datetime.now(dt.timezone.utc)
+        remaining = Counter(n.profile_id for n in new_notifications)
+        for n in new_notifications:
+            remaining[n.profile_id] -= 1
+            n.created_at = n.created_at or now - dt.timedelta(
+                milliseconds=remaining[n.profile_id])
+        created = await self._repo.insert_notifications(
+            [n for n in new_notifications if not n.aggregation_key])
+        aggregated_created, aggregated = \
+            await self._repo.insert_aggregated_notifications(
+                [n for n in new_notifications if n.aggregation_key])
+        return created + aggregated_created, aggregated
+
+    @db.transaction()
+    async def _save_stream_notifications(
+            self, entries: Dict[str, List[Notification]]) \
+            -> Tuple[List[Notification], List[Notification]]:
+        saved_entry_ids = await self._repo.save_stream_entries(list(entries))
+        return await self._save_notifications(
+            [n for entry_id, notifications in entries.items()
+             if entry_id in saved_entry_ids for n in notifications])
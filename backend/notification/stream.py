@@ -0,0 +1,129 @@
+import json
+import os
+import socket
+from typing import List, Tuple, Dict
+
+from aioredis import Redis, ReplyError
+from injector import singleton, inject
+
+from common.injection import PubSubStore
+from common.redis import RedisManager
+from config import cfg
+
+StreamEntry = Tuple[str, Dict]
+
+
+@singleton
+class NotificationStream:
+    """Durable notification queue backed by a Redis stream and a consumer group
+    shared by every backend worker.
+
+    Entries stay in the group's pending list until acknowledged: entries left
+    pending by a crashed or failing consumer are claimed again by another one,
+    while entries delivered too many times are moved to a dead-letter stream."""
+    STREAM_KEY: str = "notifications:stream"
+    DEAD_LETTER_KEY: str = "notifications:dead_letter"
+    GROUP: str = "notification_workers"
+    MAX_LEN: int = 100000
+
+    @inject
+    def __init__(self, store: PubSubStore):
+        self._store = store
+        self._consumer = f"{socket.gethostname()}-{os.getpid()}"
+
+    async def start(self) -> None:
+        """Create the consumer group (and the stream) if missing."""
+        try:
+            await self._store.xgroup_create(
+                NotificationStream.STREAM_KEY,
+                NotificationStream.GROUP,
+                latest_id="0",
+                mkstream=True)
+        except ReplyError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def connect(self) -> Redis:
+        """Open a dedicated connection for blocking reads, which would
+        otherwise stall every other command sent over the shared one."""
+        reader = RedisManager(cfg.pubsub_uri)
+        await reader.start()
+        return reader.redis
+
+    async def add(self, item: Dict) -> None:
+        """Append a notification to the stream."""
+        await self._store.xadd(NotificationStream.STREAM_KEY,
+                               {"item": json.dumps(item)},
+                               max_len=NotificationStream.MAX_LEN)
+
+    async def read(self, reader: Redis, count: int, timeout: float) \
+            -> List[StreamEntry]:
+        """Read up to 'count' new entries, blocking at most 'timeout'
+        seconds."""
+        entries = await reader.xread_group(
+            NotificationStream.GROUP,
+            self._consumer,
+            [NotificationStream.STREAM_KEY],
+            timeout=max(int(timeout * 1000), 1),
+            count=count,
+            latest_ids=[">"])
+        return [(entry_id, json.loads(fields["item"]))
+                for _, entry_id, fields in entries]
+
+    async def ack(self, entry_ids: List[str]) -> None:
+        """Acknowledge successfully delivered entries."""
+        if entry_ids:
+            await self._store.xack(NotificationStream.STREAM_KEY,
+                                   NotificationStream.GROUP,
+                                   *entry_ids)
+
+    async def pending_count(self) -> int:
+        """Return the number of delivered but not yet acknowledged entries."""
+        summary = await self._store.xpending(NotificationStream.STREAM_KEY,
+                                             NotificationStream.GROUP)
+        return summary[0] if summary else 0
+
+    async def claim_stale(
+            self,
+            min_idle: float,
+            max_deliveries: int,
+            count: int) -> Tuple[List[StreamEntry], int]:
+        """
+        Claim entries pending for longer than 'min_idle' seconds, moving the
+        ones already delivered 'max_deliveries' times to the dead-letter stream.
+
+        :return: claimed entries to be retried, number of dead-lettered entries
+        """
+        min_idle_ms = int(min_idle * 1000)
+        pending = await self._store.xpending(NotificationStream.STREAM_KEY,
+                                             NotificationStream.GROUP,
+                                             "-", "+", count)
+        stale = [(entry_id, deliveries)
+                 for entry_id, _, idle, deliveries in pending
+                 if idle >= min_idle_ms]
+        dead_ids = [entry_id for entry_id, deliveries in stale
+                    if deliveries >= max_deliveries]
+        retry_ids = [entry_id for entry_id, deliveries in stale
+                     if deliveries < max_deliveries]
+        if dead_ids:
+            dead = await self._store.xclaim(NotificationStream.STREAM_KEY,
+                                            NotificationStream.GROUP,
+                                            self._consumer,
+                                            min_idle_ms,
+                                            *dead_ids)
+            pipe = self._store.pipeline()
+            for entry_id, fields in dead:
+                pipe.xadd(NotificationStream.DEAD_LETTER_KEY,
+                          {**fields, "id": entry_id},
+                          max_len=NotificationStream.MAX_LEN)
+            pipe.xack(NotificationStream.STREAM_KEY,
+                      NotificationStream.GROUP,
+                      *dead_ids)
+            await pipe.execute()
+        retry = await self._store.xclaim(NotificationStream.STREAM_KEY,
+                                         NotificationStream.GROUP,
+                                         self._consumer,
+                                         min_idle_ms,
+                                         *retry_ids) if retry_ids else []
+        return [(entry_id, json.loads(fields["item"]))
+                for entry_id, fields in retry], len(dead_ids)
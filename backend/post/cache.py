@@ -6,77 +6,179 @@ from uuid import UUID
 from fastapi.encoders import jsonable_encoder
 from injector import singleton, inject
 
-from common.cache import fail_silently, hash_cache_key
+from common.cache import fail_silently, LocalCaches
 from common.injection import Cache
 from database.utils import map_to
-from post.models import Post
+from post.models import Post, PostPrivacy, PostTimelineEntry
 
 
 @singleton
 class PostCache:
     POSTS_EX: int = int(dt.timedelta(minutes=1).total_seconds())
+    # ids of the latest posts of each wall are kept in a sorted set by creation
+    # date, as "<privacy>:<post id>" members; a "since" member scores the date
+    # from which the set holds every post of the wall (-inf for all of them)
+    TIMELINE_MAX_SIZE: int = 1000
+    TIMELINE_EX: int = int(dt.timedelta(minutes=10).total_seconds())
+    STALE_EX: int = 10
+    GET_TIMELINE_SCRIPT: str = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return nil
+    end
+    local limit, posts_ids, offset = tonumber(ARGV[2]), {}, 0
+    while #posts_ids < limit do
+        local members = redis.call('ZREVRANGEBYSCORE', KEYS[1],
+            '(' .. ARGV[1], '-inf', 'LIMIT', offset, limit)
+        for _, member in ipairs(members) do
+            local privacy, post_id = string.match(member, '^(%u+):(.+)$')
+            if privacy == 'PUBLIC' or (privacy and ARGV[3] == '1') then
+                table.insert(posts_ids, post_id)
+                if #posts_ids == limit then
+                    break
+                end
+            end
+        end
+        if #members < limit then
+            -- a partial page can be served only if the set holds every post
+            if redis.call('ZSCORE', KEYS[1], 'since') ~= '-inf' then
+                return nil
+            end
+            break
+        end
+        offset = offset + limit
+    end
+    return posts_ids"""
+    # append only to already filled sets, which must not miss posts; otherwise
+    # flag the set as stale, so that a concurrent fill which read from
+    # PostgreSQL before this post was committed is discarded
+    ADD_TO_TIMELINE_SCRIPT: str = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+    else
+        redis.call('SET', KEYS[2], 1, 'EX', ARGV[3])
+    end
+    return nil"""
+    SET_TIMELINE_SCRIPT: str = """
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        return 0
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('ZADD', KEYS[1], unpack(ARGV, 2))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 1"""
 
     @inject
-    def __init__(self, cache: Cache):
+    def __init__(self, cache: Cache, local_caches: LocalCaches):
         self._cache = cache
+        self._local_caches = local_caches
+        self._local = local_caches.create("posts")
 
     @fail_silently()
-    async def get_posts(
-            self,
-            wall_profile_id: UUID,
-            include_friends: bool,
-            older_than: dt.datetime) -> Optional[List[Post]]:
-        cached_posts_ids = await self._cache.get(
-            f"walls:{wall_profile_id}:posts:"
-            f"{hash_cache_key(wall_profile_id, include_friends, older_than)}")
-        cached_posts_ids = cached_posts_ids and json.loads(cached_posts_ids)
-        if not cached_posts_ids:
-            return None
+    async def get_posts(self, posts_ids: List[UUID]) \
+            -> Optional[List[Optional[Post]]]:
+        """Return cached posts in the same order as 'posts_ids', with None
+        in place of the missing ones."""
+        posts = [self._local.get(f"posts:{post_id}") for post_id in posts_ids]
+        missing_ids = [post_id for post_id, post in zip(posts_ids, posts)
+                       if post is None]
+        if not missing_ids:
+            return posts
         cached_posts = await self._cache.mget(
-            *[f"posts:{post_id}" for post_id in cached_posts_ids])
-        return (all(cached_posts) or None) and [map_to(json.loads(post), Post)
-                                                for post in cached_posts]
+            *[f"posts:{post_id}" for post_id in missing_ids])
+        cached_posts = iter([self._read_post(post_id, cached_post)
+                             for post_id, cached_post
+                             in zip(missing_ids, cached_posts)])
+        return [post or next(cached_posts) for post in posts]
 
     @fail_silently()
     async def get_post(self, post_id: UUID) -> Optional[Post]:
-        cached_post = await self._cache.get(f"posts:{post_id}")
-        return cached_post and map_to(json.loads(cached_post), Post)
+        if post := self._local.get(f"posts:{post_id}"):
+            return post
+        return self._read_post(post_id,
+                               await self._cache.get(f"posts:{post_id}"))
 
     @fail_silently()
     async def set_post(self, post: Post) -> None:
-        await self._cache.set(f"posts:{post.id}",
-                              json.dumps(jsonable_encoder(post)),
-                              expire=PostCache.POSTS_EX)
+        await self.set_posts([post])
 
     @fail_silently()
-    async def set_posts(
-            self,
-            posts: List[Post],
-            wall_profile_id: UUID,
-            include_friends: bool,
-            older_than: Optional[dt.date]) -> None:
-        params_cache_key = hash_cache_key(
-            wall_profile_id, include_friends, older_than)
-        posts_ids_key = f"walls:{wall_profile_id}:posts:{params_cache_key}"
+    async def set_posts(self, posts: List[Post]) -> None:
+        if not posts:
+            return
         pipe = self._cache.pipeline()
-        pipe.mset(posts_ids_key, json.dumps([str(post.id) for post in posts]),
-                  *list(sum([(f"posts:{post.id}",
+        pipe.mset(*list(sum([(f"posts:{post.id}",
                               json.dumps(jsonable_encoder(post)))
                              for post in posts], ())))
-        for key in [posts_ids_key, *[f"posts:{post.id}" for post in posts]]:
-            pipe.expire(key, PostCache.POSTS_EX)
+        for post in posts:
+            pipe.expire(f"posts:{post.id}", PostCache.POSTS_EX)
+            self._local.set(f"posts:{post.id}", post)
         await pipe.execute()
 
     @fail_silently()
-    async def unset_posts_ids(
+    async def get_timeline_posts_ids(
             self,
             wall_profile_id: UUID,
             include_friends: bool,
-            older_than: Optional[dt.date]) -> None:
-        await self._cache.delete(
-            f"walls:{wall_profile_id}:posts:"
-            f"{hash_cache_key(wall_profile_id, include_friends, older_than)}")
+            older_than: dt.datetime,
+            limit: int) -> Optional[List[UUID]]:
+        """Return ids of the wall posts older than 'older_than', or None if
+        the timeline is not cached or doesn't reach that far."""
+        posts_ids = await self._cache.eval(
+            PostCache.GET_TIMELINE_SCRIPT,
+            keys=[f"walls:{wall_profile_id}:timeline"],
+            args=[repr(older_than.timestamp()), limit,
+                  int(bool(include_friends))])
+        return [UUID(post_id) for post_id in posts_ids] \
+            if posts_ids is not None else None
+
+    @fail_silently()
+    async def has_timeline(self, wall_profile_id: UUID) -> Optional[bool]:
+        return await self._cache.exists(
+            f"walls:{wall_profile_id}:timeline") or None
+
+    @fail_silently()
+    async def set_timeline(
+            self,
+            wall_profile_id: UUID,
+            posts: List[PostTimelineEntry],
+            complete: bool) -> None:
+        """Cache the latest posts of a wall; 'complete' tells whether they are
+        all the posts of the wall."""
+        since = "-inf" if complete or not posts \
+            else repr(posts[-1].created_at.timestamp())
+        await self._cache.eval(
+            PostCache.SET_TIMELINE_SCRIPT,
+            keys=[f"walls:{wall_profile_id}:timeline",
+                  f"walls:{wall_profile_id}:timeline:stale"],
+            args=[PostCache.TIMELINE_EX, since, "since",
+                  *[item for post in posts
+                    for item in (repr(post.created_at.timestamp()),
+                                 f"{post.privacy.value}:{post.id}")]])
+
+    @fail_silently()
+    async def add_to_timeline(self, post: Post) -> None:
+        await self._cache.eval(
+            PostCache.ADD_TO_TIMELINE_SCRIPT,
+            keys=[f"walls:{post.wall_profile_id}:timeline",
+                  f"walls:{post.wall_profile_id}:timeline:stale"],
+            args=[repr(post.created_at.timestamp()),
+                  f"{post.privacy.value}:{post.id}",
+                  PostCache.STALE_EX])
+
+    @fail_silently()
+    async def remove_from_timeline(self, post: Post) -> None:
+        await self._cache.zrem(f"walls:{post.wall_profile_id}:timeline",
+                               *[f"{privacy.value}:{post.id}"
+                                 for privacy in PostPrivacy])
 
     @fail_silently()
     async def unset_post(self, post_id: UUID) -> None:
         await self._cache.delete(f"posts:{post_id}")
+        await self._local_caches.invalidate(f"posts:{post_id}")
+
+    def _read_post(self, post_id: UUID, cached_post: Optional[str]) \
+            -> Optional[Post]:
+        self._local.record_redis_read(cached_post is not None)
+        post = cached_post and map_to(json.loads(cached_post), Post)
+        self._local.set(f"posts:{post_id}", post)
+        return post
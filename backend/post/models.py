@@ -45,3 +45,9 @@ class Post(BaseModel):
     privacy: PostPrivacy
     comments_count: int = 0
 
+
+
+class PostTimelineEntry(BaseModel):
+    id: UUID
+    created_at: dt.datetime
+    privacy: PostPrivacy
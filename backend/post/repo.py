@@ -6,17 +6,19 @@ from injector import singleton, inject
 from sqlalchemy import insert, select, delete, desc, literal, update
 
 from auth.models import profile
+from common.cache import SingleFlight
 from database.core import db
-from database.utils import map_result, map_to
+from database.utils import map_to
 from post.cache import PostCache
-from post.models import Post, post, PostPrivacy
+from post.models import Post, post, PostPrivacy, PostTimelineEntry
 
 
 @singleton
 class PostRepo:
     @inject
-    def __init__(self, cache: PostCache):
+    def __init__(self, cache: PostCache, single_flight: SingleFlight):
         self._cache = cache
+        self._single_flight = single_flight
 
     async def save_post(self, new_post: Post) -> Post:
         saved_post = await db.fetch_one(
@@ -26,18 +28,15 @@ class PostRepo:
                 .returning(post))
         saved_post: Post = map_to(saved_post, Post)
         saved_post.username = new_post.username
-        await self._cache.unset_posts_ids(
-            new_post.wall_profile_id, True, None)
-        if new_post.privacy == PostPrivacy.PUBLIC:
-            await self._cache.unset_posts_ids(
-                new_post.wall_profile_id, False, None)
+        await self._cache.add_to_timeline(saved_post)
         return saved_post
 
-    @map_result
     async def delete_post(self, post_id: UUID) -> Optional[Post]:
-        deleted_post = await db.fetch_one(delete(post)
-                                          .where(post.c.id == post_id)
-                                          .returning(post))
+        deleted_post = map_to(await db.fetch_one(delete(post)
+                                                 .where(post.c.id == post_id)
+                                                 .returning(post)), Post)
+        if deleted_post:
+            await self._cache.remove_from_timeline(deleted_post)
         await self._cache.unset_post(post_id)
         return deleted_post
 
@@ -48,9 +47,20 @@ class PostRepo:
             older_than: Optional[dt.datetime] = None,
             limit: int = 10) -> List[Post]:
         older_than_clause = older_than or dt.datetime.now(dt.timezone.utc)
-        if (posts := await self._cache.get_posts(
-                wall_profile_id, include_friends, older_than)) is not None:
-            return posts
+        posts_ids = await self._cache.get_timeline_posts_ids(
+            wall_profile_id, include_friends, older_than_clause, limit)
+        if posts_ids is not None:
+            return await self._find_posts_by_ids(posts_ids)
+        if older_than is None:
+            # concurrent first page reads of a wall fill its timeline once
+            await self._single_flight.run(
+                f"walls:{wall_profile_id}:timeline",
+                lambda: self._fill_timeline(wall_profile_id),
+                read=lambda: self._cache.has_timeline(wall_profile_id))
+            posts_ids = await self._cache.get_timeline_posts_ids(
+                wall_profile_id, include_friends, older_than_clause, limit)
+            if posts_ids is not None:
+                return await self._find_posts_by_ids(posts_ids)
         in_clause_values = [
             privacy for privacy, should_include in
             zip([literal(PostPrivacy.PUBLIC.value),
@@ -66,8 +76,7 @@ class PostRepo:
                 .order_by(desc(post.c.created_at))
                 .limit(limit))
         posts = map_to(posts, List[Post])
-        await self._cache.set_posts(
-            posts, wall_profile_id, include_friends, older_than)
+        await self._cache.set_posts(posts)
         return posts
 
     async def find_post_by_id(self, post_id: UUID) -> Optional[Post]:
@@ -82,6 +91,41 @@ class PostRepo:
             await self._cache.set_post(post_by_id)
         return post_by_id
 
+    async def _find_posts_by_ids(self, posts_ids: List[UUID]) -> List[Post]:
+        # read cached posts and fetch only the missing ones, which are cached
+        # again; posts deleted in the meanwhile are left out
+        cached_posts = await self._cache.get_posts(posts_ids) \
+                       or [None] * len(posts_ids)
+        missing_ids = [post_id for post_id, cached_post
+                       in zip(posts_ids, cached_posts) if not cached_post]
+        if not missing_ids:
+            return cached_posts
+        missing_posts = map_to(await db.fetch_all(
+            select([post, profile.c.username])
+                .where(post.c.profile_id == profile.c.id)
+                .where(post.c.id.in_(missing_ids))), List[Post])
+        await self._cache.set_posts(missing_posts)
+        missing_posts = {missing_post.id: missing_post
+                         for missing_post in missing_posts}
+        return [cached_post or missing_posts[post_id]
+                for post_id, cached_post in zip(posts_ids, cached_posts)
+                if cached_post or post_id in missing_posts]
+
+    async def _fill_timeline(self, wall_profile_id: UUID) -> bool:
+        # the timeline only holds ids, so it can cover many more posts than
+        # a page: cursors past its oldest post are served by PostgreSQL
+        latest_posts = await db.fetch_all(
+            select([post.c.id, post.c.created_at, post.c.privacy])
+                .where(post.c.wall_profile_id == wall_profile_id)
+                .order_by(desc(post.c.created_at))
+                .limit(PostCache.TIMELINE_MAX_SIZE + 1))
+        latest_posts = map_to(latest_posts, List[PostTimelineEntry])
+        await self._cache.set_timeline(
+            wall_profile_id,
+            latest_posts[:PostCache.TIMELINE_MAX_SIZE],
+            complete=len(latest_posts) <= PostCache.TIMELINE_MAX_SIZE)
+        return True
+
     async def increment_comments_count(self, post_id: UUID) -> int:
         return await self._alter_comments_count(post_id, +1)
 
@@ -6,7 +6,7 @@ from uuid import UUID
 from fastapi.encoders import jsonable_encoder
 from injector import singleton, inject
 
-from common.cache import fail_silently
+from common.cache import fail_silently, LocalCaches
 from common.injection import Cache
 from database.utils import map_to
 from profiles.models import Relationship, ProfileShort
@@ -17,8 +17,10 @@ class ProfilesCache:
     RELATIONSHIP_EX = int(dt.timedelta(minutes=10).total_seconds())
 
     @inject
-    def __init__(self, cache: Cache):
+    def __init__(self, cache: Cache, local_caches: LocalCaches):
         self._cache = cache
+        self._local_caches = local_caches
+        self._local = local_caches.create("profiles")
 
     @fail_silently()
     async def get_relationship(
@@ -27,7 +29,7 @@ class ProfilesCache:
             other_profile_id: UUID) -> str:
         min_id, max_id = min(profile_id, other_profile_id), \
                          max(profile_id, other_profile_id)
-        relationship = await self._cache.get(
+        relationship = await self._get(
             f"profiles:{min_id}:relationships:{max_id}")
         if relationship and min_id != profile_id:
             if relationship == Relationship.INCOMING_FRIEND_REQUEST.value:
@@ -52,6 +54,8 @@ class ProfilesCache:
                 relationship = Relationship.OUTGOING_FRIEND_REQUEST
             elif relationship == Relationship.OUTGOING_FRIEND_REQUEST:
                 relationship = Relationship.INCOMING_FRIEND_REQUEST
+        self._local.set(f"profiles:{min_id}:relationships:{max_id}",
+                        relationship.value)
         return await self._cache.set(
             f"profiles:{min_id}:relationships:{max_id}",
             relationship.value,
@@ -65,24 +69,33 @@ class ProfilesCache:
             delete_cached_friends: bool = False) -> int:
         min_id, max_id = min(profile_id, other_profile_id), \
                          max(profile_id, other_profile_id)
-        return await self._cache.delete(
-            f"profiles:{min_id}:relationships:{max_id}",
-            *([f"profiles:{profile_id}:friends",
-               f"profiles:{other_profile_id}:friends"]
-              if delete_cached_friends else []))
+        keys = [f"profiles:{min_id}:relationships:{max_id}",
+                *([f"profiles:{profile_id}:friends",
+                   f"profiles:{other_profile_id}:friends"]
+                  if delete_cached_friends else [])]
+        deleted = await self._cache.delete(*keys)
+        await self._local_caches.invalidate(*keys)
+        return deleted
 
     @fail_silently()
     async def get_friends(self, profile_id: UUID) \
             -> Optional[List[ProfileShort]]:
+        if (friends := self._local.get(f"profiles:{profile_id}:friends")) \
+                is not None:
+            return friends
         json_friends = await self._cache.get(f"profiles:{profile_id}:friends")
-        return map_to(json.loads(json_friends), List[ProfileShort]) \
+        self._local.record_redis_read(json_friends is not None)
+        friends = map_to(json.loads(json_friends), List[ProfileShort]) \
             if json_friends else None
+        self._local.set(f"profiles:{profile_id}:friends", friends)
+        return friends
 
     @fail_silently()
     async def set_friends(
             self,
             profile_id: UUID,
             friends: List[ProfileShort]) -> None:
+        self._local.set(f"profiles:{profile_id}:friends", friends)
         return await self._cache.set(
             f"profiles:{profile_id}:friends",
             json.dumps(jsonable_encoder(friends)),
@@ -90,5 +103,14 @@ class ProfilesCache:
 
     @fail_silently()
     async def unset_friends(self, profile_ids: List[UUID]) -> None:
-        return await self._cache.delete(*[f"profiles:{profile_id}:friends"
-                                          for profile_id in profile_ids])
+        keys = [f"profiles:{profile_id}:friends" for profile_id in profile_ids]
+        await self._cache.delete(*keys)
+        await self._local_caches.invalidate(*keys)
+
+    async def _get(self, key: str) -> Optional[str]:
+        if (value := self._local.get(key)) is not None:
+            return value
+        value = await self._cache.get(key)
+        self._local.record_redis_read(value is not None)
+        self._local.set(key, value)
+        return value
@@ -7,6 +7,7 @@ from sqlalchemy import select, desc, literal
 from auth.models import profile
 from chat.models import ChatGroup
 from chat.repo import ChatRepo
+from common.cache import SingleFlight
 from database.core import db
 from database.graph import AsyncGraphDatabase
 from database.utils import map_result, map_graph_result, map_to
@@ -18,10 +19,11 @@ from profiles.models import ProfileShort, Relationship
 class ProfilesRepo:
     @inject
     def __init__(self, cache: ProfilesCache, graph_db: AsyncGraphDatabase,
-                 chat_repo: ChatRepo):
+                 chat_repo: ChatRepo, single_flight: SingleFlight):
         self._cache = cache
         self._graph_db = graph_db
         self._chat_repo = chat_repo
+        self._single_flight = single_flight
 
     @map_result
     async def find_profiles_by_username_search(
@@ -196,6 +198,21 @@ class ProfilesRepo:
             return Relationship(relationship)
         if profile_id == other_profile_id:
             return Relationship.SELF
+
+        async def read_relationship() -> Optional[Relationship]:
+            relationship = await self._cache.get_relationship(
+                profile_id, other_profile_id)
+            return relationship and Relationship(relationship)
+
+        return await self._single_flight.run(
+            f"profiles:{profile_id}:relationships:{other_profile_id}",
+            lambda: self._fill_relationship(profile_id, other_profile_id),
+            read=read_relationship)
+
+    async def _fill_relationship(
+            self,
+            profile_id: UUID,
+            other_profile_id: UUID) -> Relationship:
         result = await self._graph_db.read_tx(lambda tx: list(tx.run(f"""
         MATCH (profile:Profile {{id: '{profile_id}'}})\
         -[r]-\
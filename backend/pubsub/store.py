@@ -1,33 +1,214 @@
+import asyncio
 import datetime as dt
-from typing import Union, List
+import time
+from asyncio import Queue, get_event_loop
+from typing import Union, List, AsyncIterator, Tuple, Dict, Optional
 from uuid import UUID
 
+from aioredis.pubsub import Receiver
 from injector import singleton, inject
 
 from common.injection import PubSubStore
+from common.log import logger
+from common.redis import RedisManager
 from common.schemas import dt_to_iso8601z
+from config import cfg
+
+PresenceChange = Tuple[str, bool]
 
 
 @singleton
 class WebSocketsStore:
+    """Online status of profiles, renewed on every connect and ping.
+
+    With the "keys" presence backend each profile has its own key expiring
+    after 'ONLINE_STATUS_EX' seconds, whose expiration signals the profile
+    going offline. With the "sorted_set" backend last seen timestamps are
+    stored in a single sorted set instead: renewals are buffered and written
+    once per 'presence_tick', when every worker also looks for the profiles
+    that just went offline."""
     ONLINE_STATUS_EX: int = int(dt.timedelta(seconds=11).total_seconds())
+    LAST_SEEN_KEY: str = "websockets:last_seen"
+    PRESENCE_CHANNEL: str = "websockets:presence"
+    EXPIRED_KEYS_PATTERN: str = "__keyevent@*__:expired"
+    FLUSH_CHUNK_SIZE: int = 1000
+    # ARGV: presence channel, online threshold, (timestamp, profile id) pairs
+    RENEW_SCRIPT: str = """
+    local profile_ids = {}
+    for i = 4, #ARGV, 2 do
+        profile_ids[#profile_ids + 1] = ARGV[i]
+    end
+    local previous = redis.call('ZMSCORE', KEYS[1], unpack(profile_ids))
+    redis.call('ZADD', KEYS[1], unpack(ARGV, 3))
+    for i, profile_id in ipairs(profile_ids) do
+        if not previous[i] or tonumber(previous[i]) <= tonumber(ARGV[2]) then
+            redis.call('PUBLISH', ARGV[1], profile_id)
+        end
+    end
+    return nil"""
 
     @inject
     def __init__(self, store: PubSubStore):
         self._store = store
+        # must postpone Queue creation to FastAPI startup event
+        self._presence_changes: Optional[Queue[PresenceChange]] = None
+        self._pending_renewals: Dict[str, float] = {}
+
+    def start(self):
+        self._presence_changes = Queue()
+        get_event_loop().create_task(self._listen_for_published_changes())
+        if cfg.presence_backend == "sorted_set":
+            get_event_loop().create_task(self._flush_every_tick())
+        else:
+            get_event_loop().create_task(self._enable_expiration_events())
 
     async def renew_online_status(self, profile_id: Union[str, UUID]):
-        """Refresh online status for profile_id."""
-        await self._store.set(f"websockets:{profile_id}",
-                              dt_to_iso8601z(dt.datetime.now(dt.timezone.utc)),
-                              expire=WebSocketsStore.ONLINE_STATUS_EX)
+        """Refresh online status for profile_id, publishing a presence change
+        if the profile was offline."""
+        if cfg.presence_backend == "sorted_set":
+            self._pending_renewals[str(profile_id)] = time.time()
+            return
+        transaction = self._store.multi_exec()
+        transaction.getset(f"websockets:{profile_id}",
+                           dt_to_iso8601z(dt.datetime.now(dt.timezone.utc)))
+        transaction.expire(f"websockets:{profile_id}",
+                           WebSocketsStore.ONLINE_STATUS_EX)
+        last_seen, _ = await transaction.execute()
+        if last_seen is None:
+            await self._store.publish(WebSocketsStore.PRESENCE_CHANNEL,
+                                      str(profile_id))
 
     async def get_online_statuses(self, profile_ids: List[Union[str, UUID]]) \
             -> List[str]:
         """Return list of online profile ids."""
         if not profile_ids:
             return []
+        if cfg.presence_backend == "sorted_set":
+            online_since = time.time() - WebSocketsStore.ONLINE_STATUS_EX
+            last_seen = await self._get_last_seen_timestamps(profile_ids)
+            return [str(profile_id) for profile_id, timestamp
+                    in zip(profile_ids, last_seen)
+                    if timestamp is not None and timestamp > online_since]
         result = await self._store.mget(*[f"websockets:{profile_id}"
                                           for profile_id in profile_ids])
         return [str(friend_id) for friend_id, is_online
                 in zip(profile_ids, result) if is_online]
+
+    async def get_last_seen(self, profile_ids: List[Union[str, UUID]]) \
+            -> Dict[str, Optional[dt.datetime]]:
+        """Return last time profiles were seen online (with the "keys" backend
+        only currently online profiles are known)."""
+        if not profile_ids:
+            return {}
+        if cfg.presence_backend == "sorted_set":
+            last_seen = [
+                dt.datetime.fromtimestamp(timestamp, dt.timezone.utc)
+                if timestamp is not None else None
+                for timestamp in
+                await self._get_last_seen_timestamps(profile_ids)]
+        else:
+            last_seen = [
+                dt.datetime.fromisoformat(value.replace("Z", "+00:00"))
+                if value is not None else None
+                for value in await self._store.mget(
+                    *[f"websockets:{profile_id}"
+                      for profile_id in profile_ids])]
+        return {str(profile_id): timestamp for profile_id, timestamp
+                in zip(profile_ids, last_seen)}
+
+    async def listen_for_presence_changes(self) \
+            -> AsyncIterator[PresenceChange]:
+        """Yield (profile id, is online) presence changes of any profile."""
+        while True:
+            yield await self._presence_changes.get()
+
+    async def _get_last_seen_timestamps(
+            self, profile_ids: List[Union[str, UUID]]) \
+            -> List[Optional[float]]:
+        scores = await self._store.execute(
+            "ZMSCORE",
+            WebSocketsStore.LAST_SEEN_KEY,
+            *[str(profile_id) for profile_id in profile_ids])
+        return [float(score) if score is not None else None
+                for score in scores]
+
+    async def _flush_every_tick(self):
+        last_tick = time.time()
+        while True:
+            await asyncio.sleep(cfg.presence_tick)
+            now = time.time()
+            try:
+                await self._flush_renewals()
+                await self._find_expired(last_tick, now)
+            except Exception as e:
+                logger.error("Presence flush failed")
+                continue
+            last_tick = now
+
+    async def _flush_renewals(self):
+        # a single round trip per chunk of profiles updates last seen
+        # timestamps and publishes the profiles which just came online
+        renewals, self._pending_renewals = self._pending_renewals, {}
+        renewals = list(renewals.items())
+        online_since = time.time() - WebSocketsStore.ONLINE_STATUS_EX
+        for i in range(0, len(renewals), WebSocketsStore.FLUSH_CHUNK_SIZE):
+            await self._store.eval(
+                WebSocketsStore.RENEW_SCRIPT,
+                keys=[WebSocketsStore.LAST_SEEN_KEY],
+                args=[WebSocketsStore.PRESENCE_CHANNEL, online_since,
+                      *[item for profile_id, timestamp in
+                        renewals[i:i + WebSocketsStore.FLUSH_CHUNK_SIZE]
+                        for item in (timestamp, profile_id)]])
+
+    async def _find_expired(self, since: float, until: float):
+        # every worker looks for the profiles whose last renewal expired since
+        # previous tick, and reports them to its own sockets only
+        expired = await self._store.zrangebyscore(
+            WebSocketsStore.LAST_SEEN_KEY,
+            min=since - WebSocketsStore.ONLINE_STATUS_EX,
+            max=until - WebSocketsStore.ONLINE_STATUS_EX,
+            exclude=self._store.ZSET_EXCLUDE_MIN)
+        for profile_id in expired:
+            self._presence_changes.put_nowait((profile_id, False))
+
+    async def _enable_expiration_events(self):
+        # make Redis publish key expirations, which signal profiles going
+        # offline (keeping other keyspace events already enabled)
+        try:
+            config = await self._store.config_get("notify-keyspace-events")
+            events = set(config.get("notify-keyspace-events", "")) | {"E", "x"}
+            await self._store.config_set("notify-keyspace-events",
+                                         "".join(sorted(events)))
+        except Exception as e:
+            logger.error("Couldn't enable Redis expiration events: offline "
+                         "presence changes require 'notify-keyspace-events Ex'")
+
+    async def _listen_for_published_changes(self):
+        while True:
+            try:
+                await self._receive_published_changes()
+            except Exception as e:
+                logger.error("Presence subscription failed")
+            await asyncio.sleep(1)
+
+    async def _receive_published_changes(self):
+        # use a dedicated connection, since subscribed connections can't send
+        # other commands
+        subscriber = RedisManager(cfg.pubsub_uri)
+        await subscriber.start()
+        receiver = Receiver()
+        try:
+            await subscriber.redis.subscribe(
+                receiver.channel(WebSocketsStore.PRESENCE_CHANNEL))
+            await subscriber.redis.psubscribe(
+                receiver.pattern(WebSocketsStore.EXPIRED_KEYS_PATTERN))
+            async for sender, message in receiver.iter(encoding="utf-8"):
+                if not sender.is_pattern:
+                    self._presence_changes.put_nowait((message, True))
+                    continue
+                _, key = message
+                prefix, _, profile_id = key.partition(":")
+                if prefix == "websockets" and profile_id:
+                    self._presence_changes.put_nowait((profile_id, False))
+        finally:
+            subscriber.redis.close()
@@ -1,7 +1,7 @@
 import asyncio
 from abc import ABC, abstractmethod
 from http.cookies import SimpleCookie
-from typing import Dict, Union, Callable, Coroutine, List, Any
+from typing import Dict, Union, Callable, Coroutine, List, Any, Optional
 from uuid import UUID
 
 import injector
@@ -18,7 +18,9 @@ from common.injection import injector
 from config import cfg
 from pubsub.store import WebSocketsStore
 
-OnConnectCallback = Union[Callable[[str, User], Any], Coroutine]
+# on connect callbacks may return events (by name) to be sent to the new socket
+OnConnectCallback = Union[
+    Callable[[str, User], Optional[Dict[str, Any]]], Coroutine]
 
 
 class WsRouter(ABC):
@@ -36,6 +38,9 @@ class SioSession(BaseModel):
     private_chats: List[PrivateChat]
 
 
+OnDisconnectCallback = Union[Callable[[str, SioSession], Any], Coroutine]
+
+
 async def get_sio_session(sid: str) -> SioSession:
     """Return Socket.IO session object linked to specified sid."""
     return await injector.get(WebSockets).sio.get_session(sid)
@@ -59,6 +64,7 @@ class WebSockets(WsRouter):
             allow_upgrades=True)
         self._store = store
         self._on_connect_listeners: List[OnConnectCallback] = []
+        self._on_disconnect_listeners: List[OnDisconnectCallback] = []
         self.include_ws_router(self)
 
     def include_socketio(self, app, path: str = "/"):
@@ -66,18 +72,25 @@ class WebSockets(WsRouter):
         socketio_asgi_app = socketio.ASGIApp(self._sio, app)
         app.mount(path, socketio_asgi_app)
 
-    async def send(self, event: str, payload: Any, to: Union[str, UUID]) \
-            -> None:
+    async def send(
+            self,
+            event: str,
+            payload: Any,
+            to: Union[str, UUID],
+            local: bool = False) -> None:
         """
         Send a message via websocket to specified room or sid.
 
         :param event: Socket.IO message event
         :param payload: Socket.IO message payload
         :param to: room id or sid
+        :param local: deliver to sockets connected to this worker only,
+            skipping the Redis message queue
         """
         await self._sio.emit(event,
                              jsonable_encoder(payload),
-                             room=str(to))
+                             room=str(to),
+                             ignore_queue=local)
 
     def subscribe_to_on_connect(self, callback: OnConnectCallback):
         """Link a callback to the 'on_connect' Socket.IO event."""
@@ -87,6 +100,14 @@ class WebSockets(WsRouter):
         """Unlink a callback from the 'on_connect' Socket.IO event."""
         self._on_connect_listeners.remove(callback)
 
+    def subscribe_to_on_disconnect(self, callback: OnDisconnectCallback):
+        """Link a callback to the 'on_disconnect' Socket.IO event."""
+        self._on_disconnect_listeners.append(callback)
+
+    def unsubscribe_from_on_disconnect(self, callback: OnDisconnectCallback):
+        """Unlink a callback from the 'on_disconnect' Socket.IO event."""
+        self._on_disconnect_listeners.remove(callback)
+
     @property
     def sio(self) -> socketio.AsyncServer:
         """Return the Socket.IO instance."""
@@ -106,9 +127,32 @@ class WebSockets(WsRouter):
         sio.on("ping", self._on_ping)
 
     async def _notify_on_connect_listeners(self, sid: str, user: User):
-        for listener in self._on_connect_listeners:
-            await listener(sid, user) if asyncio.iscoroutinefunction(listener) \
-                else listener(sid, user)
+        # run listeners concurrently, then send the events they returned as a
+        # single "bootstrap" message of [event, payload] pairs
+        results = await asyncio.gather(*[
+            self._call_on_connect_listener(listener, sid, user)
+            for listener in self._on_connect_listeners])
+        bootstrap = [[event, payload]
+                     for events in results if events
+                     for event, payload in events.items()]
+        if bootstrap:
+            await self.send("bootstrap", bootstrap, to=sid)
+
+    @staticmethod
+    async def _call_on_connect_listener(
+            listener: OnConnectCallback,
+            sid: str,
+            user: User) -> Optional[Dict[str, Any]]:
+        return await listener(sid, user) \
+            if asyncio.iscoroutinefunction(listener) \
+            else listener(sid, user)
+
+    async def _notify_on_disconnect_listeners(
+            self, sid: str, session: SioSession):
+        for listener in self._on_disconnect_listeners:
+            await listener(sid, session) \
+                if asyncio.iscoroutinefunction(listener) \
+                else listener(sid, session)
 
     async def _on_connect(self, sid: str, environ: Dict, auth: Dict):
         # WebSocket authentication method: check access token signature only and
@@ -135,3 +179,4 @@ class WebSockets(WsRouter):
     async def _on_disconnect(self, sid: str):
         if session := await get_sio_session(sid):
             self._sio.leave_room(sid=sid, room=str(session.user.id))
+            await self._notify_on_disconnect_listeners(sid, session)
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import time
+from uuid import uuid4
+
+import pytest
+
+from common.cache import SingleFlight, LocalCache, LocalCaches
+from common.injection import injector, Cache
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_fill():
+    key, fills = f"test:{uuid4()}", 0
+
+    async def fill():
+        nonlocal fills
+        fills += 1
+        await asyncio.sleep(0.1)
+        return "filled"
+
+    results = await asyncio.gather(
+        *[injector.get(SingleFlight).run(key, fill) for _ in range(5)])
+    assert results == ["filled"] * 5
+    assert fills == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_caller():
+    single_flight = injector.get(SingleFlight)
+    key, started = f"test:{uuid4()}", asyncio.Event()
+
+    async def fill():
+        started.set()
+        await asyncio.sleep(0.1)
+        return "filled"
+
+    first = asyncio.ensure_future(single_flight.run(key, fill))
+    await started.wait()
+    second = asyncio.ensure_future(single_flight.run(key, fill))
+    first.cancel()
+    # the fill awaited by the second caller goes on
+    assert await second == "filled"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+@pytest.mark.asyncio
+async def test_single_flight_waits_for_other_worker_fill():
+    key, cached, fills = f"test:{uuid4()}", None, 0
+
+    async def fill():
+        nonlocal fills
+        fills += 1
+        return "filled"
+
+    async def read():
+        return cached
+
+    async def fill_from_other_worker():
+        nonlocal cached
+        await asyncio.sleep(0.2)
+        cached = "filled by other worker"
+
+    await injector.get(Cache).set(f"leases:{key}", "other worker",
+                                  pexpire=SingleFlight.LEASE_EX_MS)
+    result, _ = await asyncio.gather(
+        injector.get(SingleFlight).run(key, fill, read),
+        fill_from_other_worker())
+    assert result == "filled by other worker"
+    assert fills == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_takes_over_released_lease():
+    key = f"test:{uuid4()}"
+
+    async def fill():
+        return "filled"
+
+    async def read():
+        return None
+
+    async def release_without_filling():
+        await asyncio.sleep(0.2)
+        await injector.get(Cache).delete(f"leases:{key}")
+
+    await injector.get(Cache).set(f"leases:{key}", "other worker",
+                                  pexpire=SingleFlight.LEASE_EX_MS)
+    start = time.monotonic()
+    result, _ = await asyncio.gather(
+        injector.get(SingleFlight).run(key, fill, read),
+        release_without_filling())
+    assert result == "filled"
+    # no need to wait for the lease to expire
+    assert time.monotonic() - start < SingleFlight.LEASE_EX_MS / 1000
+
+
+def test_local_cache_evicts_least_recently_used():
+    local_cache = LocalCache(max_size=2, ttl=60)
+    local_cache.set("a", 1)
+    local_cache.set("b", 2)
+    assert local_cache.get("a") == 1
+    local_cache.set("c", 3)
+    assert local_cache.get("b") is None
+    assert (local_cache.get("a"), local_cache.get("c")) == (1, 3)
+
+
+def test_local_cache_expires_entries():
+    local_cache = LocalCache(max_size=2, ttl=0.05)
+    local_cache.set("a", 1)
+    assert local_cache.get("a") == 1
+    time.sleep(0.1)
+    assert local_cache.get("a") is None
+
+
+def test_local_cache_skips_none():
+    local_cache = LocalCache(max_size=2, ttl=60)
+    local_cache.set("a", None)
+    assert local_cache.get("a") is None
+    metrics = local_cache.metrics()
+    assert (metrics.local_hits, metrics.local_misses) == (0, 1)
+
+
+@pytest.mark.asyncio
+async def test_local_caches_invalidate_keys():
+    local_caches = injector.get(LocalCaches)
+    local_cache = local_caches.create(f"test-{uuid4()}")
+    local_cache.set("a", 1)
+    local_cache.set("b", 2)
+    await local_caches.invalidate("a")
+    assert local_cache.get("a") is None
+    # keys published by other workers are dropped as well
+    await injector.get(Cache).publish(LocalCaches.INVALIDATION_CHANNEL,
+                                      json.dumps(["b"]))
+    for _ in range(20):
+        if local_cache.get("b") is None:
+            break
+        await asyncio.sleep(0.05)
+    assert local_cache.get("b") is None
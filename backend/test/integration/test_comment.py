@@ -13,3 +13,28 @@ async def test_create_comment(ben):
     assert new_comment["content"] == content
     comments_request = await ben.conn.get(f"/posts/{post_id}/comments")
     assert comments_request.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_cached_comments_pages(ben):
+    post_id = (await ben.conn.post("/posts", json={"content": "Test"})) \
+        .json()["id"]
+    first_comment_id = (await ben.conn.post(f"/posts/{post_id}/comments",
+                                            json={"content": "1"})).json()["id"]
+    comments = (await ben.conn.get(f"/posts/{post_id}/comments",
+                                   params={"limit": 1})).json()
+    assert [c["id"] for c in comments] == [first_comment_id]
+    second_comment_id = (await ben.conn.post(f"/posts/{post_id}/comments",
+                                             json={"content": "2"})) \
+        .json()["id"]
+    comments = (await ben.conn.get(f"/posts/{post_id}/comments",
+                                   params={"limit": 1})).json()
+    assert [c["id"] for c in comments] == [second_comment_id]
+    older_comments = (await ben.conn.get(
+        f"/posts/{post_id}/comments",
+        params={"older_than": comments[0]["createdAt"], "limit": 1})).json()
+    assert [c["id"] for c in older_comments] == [first_comment_id]
+    comments = (await ben.conn.get(f"/posts/{post_id}/comments",
+                                   params={"limit": 2})).json()
+    assert [c["id"] for c in comments] \
+           == [second_comment_id, first_comment_id]
@@ -0,0 +1,94 @@
+import pytest
+
+from common.injection import injector
+from notification.models import Notification, NotificationData
+from notification.repo import NotificationRepo
+from notification.service import NotificationService
+
+
+async def create_notifications(profile_id: str, count: int) -> None:
+    await injector.get(NotificationService).create_notifications([
+        Notification(profile_id=profile_id,
+                     data=NotificationData(event="TEST", payload={"i": i}))
+        for i in range(count)])
+
+
+@pytest.mark.asyncio
+async def test_mark_all_notifications_as_read(ben):
+    await create_notifications(ben.id, 3)
+    cursor = (await ben.conn.get(f"/profiles/{ben.id}/notifications")) \
+        .json()[0]["createdAt"]
+    await create_notifications(ben.id, 2)
+    # notifications created after the cursor are left untouched
+    patch_request = await ben.conn.patch(
+        f"/profiles/{ben.id}/notifications",
+        params={"read": True, "up_to": cursor})
+    assert patch_request.status_code == 200
+    assert len(patch_request.json()) == 3
+    assert await injector.get(NotificationService) \
+        .count_unread_notifications_by_profile_id(ben.id) == 2
+    patch_request = await ben.conn.patch(
+        f"/profiles/{ben.id}/notifications",
+        params={"read": True})
+    assert len(patch_request.json()) == 2
+    notifications = (await ben.conn.get(
+        f"/profiles/{ben.id}/notifications")).json()
+    assert len(notifications) == 5
+    assert all(n["read"] for n in notifications)
+    assert await injector.get(NotificationService) \
+        .count_unread_notifications_by_profile_id(ben.id) == 0
+
+
+@pytest.mark.asyncio
+async def test_paginate_notifications_saved_in_one_batch(ben):
+    await create_notifications(ben.id, 3)
+    payloads, params = [], dict(limit=1)
+    for _ in range(3):
+        page = (await ben.conn.get(f"/profiles/{ben.id}/notifications",
+                                   params=params)).json()
+        payloads += [n["data"]["payload"]["i"] for n in page]
+        params = dict(limit=1, older_than=page[-1]["createdAt"])
+    assert payloads == [2, 1, 0]
+
+
+@pytest.mark.asyncio
+async def test_mark_other_profile_notifications_as_read(ben, daisy):
+    patch_request = await ben.conn.patch(
+        f"/profiles/{daisy.id}/notifications",
+        params={"read": True})
+    assert patch_request.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_save_plain_and_aggregated_notifications(ben, daisy):
+    repo = injector.get(NotificationRepo)
+    saved = await repo.save_notifications([
+        Notification(profile_id=ben.id,
+                     data=NotificationData(event="TEST", payload={"i": 0}))])
+    assert saved[0].data.payload == {"i": 0}
+
+    def aggregable(by_id: str, by_username: str) -> Notification:
+        return Notification(
+            profile_id=ben.id,
+            data=NotificationData(event="TEST_AGGREGATED",
+                                  payload={"postId": "p",
+                                           "byId": by_id,
+                                           "byUsername": by_username}),
+            aggregation_key="TEST_AGGREGATED:p",
+            aggregation={"actorsCount": 1,
+                         "latestActors": [{"id": by_id,
+                                           "username": by_username}]})
+
+    created, aggregated = await repo.save_aggregated_notifications(
+        [aggregable(ben.id, ben.username)])
+    assert (len(created), len(aggregated)) == (1, 0)
+    created, aggregated = await repo.save_aggregated_notifications(
+        [aggregable(daisy.id, daisy.username)])
+    assert (len(created), len(aggregated)) == (0, 1)
+    assert aggregated[0].data.payload["actorsCount"] == 2
+    notifications = await repo.find_notifications_by_profile_id(ben.id)
+    assert sorted(n.data.event for n in notifications) \
+           == ["TEST", "TEST_AGGREGATED"]
+    assert next(n for n in notifications
+                if n.data.event == "TEST_AGGREGATED") \
+               .data.payload["latestActors"][0]["id"] == daisy.id
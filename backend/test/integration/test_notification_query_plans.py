@@ -0,0 +1,116 @@
+import json
+import re
+from typing import Dict, Set
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from database.core import db
+from notification.repo import NotificationRepo
+
+PROFILES = 500
+NOTIFICATIONS_PER_PROFILE = 400
+NOTIFICATION_PARTITION = re.compile(r"^notification_(\d{4}_\d{2}|default)$")
+
+
+@pytest.fixture(scope="module")
+async def seeded_profile_id() -> str:
+    """Seed a large synthetic notifications dataset (10% unread) and return one
+    of its profiles."""
+    prefix = f"plan-{str(uuid4())[:8]}"
+    await db.execute(
+        query="""INSERT INTO profile (username, email, password)
+        SELECT CAST(:prefix AS text) || '-' || i,
+            CAST(:prefix AS text) || '-' || i || '@bunnybook.com', 'x'
+        FROM generate_series(1, CAST(:profiles AS integer)) i""",
+        values=dict(prefix=prefix, profiles=PROFILES))
+    event_id = await db.fetch_val(
+        query="""INSERT INTO notification_event (data)
+        VALUES ('{"event": "PLAN", "payload": {}}') RETURNING id""")
+    await db.execute(
+        query="""INSERT INTO notification (profile_id, event_id, created_at, read)
+        SELECT p.id, CAST(:event_id AS uuid), now() - make_interval(mins => i),
+            i % 10 != 0
+        FROM profile p, generate_series(1, CAST(:notifications AS integer)) i
+        WHERE p.username LIKE CAST(:prefix AS text) || '-%'""",
+        values=dict(event_id=event_id,
+                    notifications=NOTIFICATIONS_PER_PROFILE,
+                    prefix=prefix))
+    await db.execute(query="ANALYZE notification")
+    yield await db.fetch_val(
+        query="SELECT id FROM profile WHERE username = :username",
+        values=dict(username=f"{prefix}-1"))
+    await db.execute(query="DELETE FROM profile WHERE username LIKE :prefix",
+                     values=dict(prefix=f"{prefix}-%"))
+    await db.execute(query="DELETE FROM notification_event WHERE id = :id",
+                     values=dict(id=event_id))
+
+
+async def explain(query) -> Dict:
+    compiled = query.compile(dialect=postgresql.dialect(paramstyle="named"))
+    plan = await db.fetch_val(query=f"EXPLAIN (FORMAT JSON) {compiled}",
+                              values=compiled.params)
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+async def notification_scans(plan: Dict) -> Set[str]:
+    """Return how the partitions of the 'notification' table are scanned
+    (names of the partitioned indexes, including the ones read by bitmap
+    scans, or node types)."""
+    parent_indexes = {
+        index["child"]: index["parent"] for index in await db.fetch_all(
+            query="""SELECT child.relname AS child, parent.relname AS parent
+            FROM pg_inherits
+            JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+            JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+            WHERE parent.relkind = 'I'""")}
+
+    def bitmap_indexes(node: Dict) -> Set[str]:
+        # bitmap heap scans read the indexes scanned by their children
+        found = set()
+        for subplan in node.get("Plans", []):
+            if subplan["Node Type"] == "Bitmap Index Scan":
+                found.add(parent_indexes.get(subplan["Index Name"],
+                                             subplan["Index Name"]))
+            found |= bitmap_indexes(subplan)
+        return found
+
+    def scans(node: Dict) -> Set[str]:
+        found = set()
+        if NOTIFICATION_PARTITION.match(node.get("Relation Name", "")):
+            index = node.get("Index Name")
+            if index:
+                found.add(parent_indexes.get(index, index))
+            elif node["Node Type"] == "Bitmap Heap Scan":
+                found |= bitmap_indexes(node)
+            else:
+                found.add(node["Node Type"])
+        for subplan in node.get("Plans", []):
+            found |= scans(subplan)
+        return found
+
+    return scans(plan)
+
+
+@pytest.mark.asyncio
+async def test_find_notifications_uses_profile_created_at_index(
+        seeded_profile_id):
+    plan = await explain(
+        NotificationRepo._find_notifications_by_profile_id_query(
+            seeded_profile_id))
+    assert await notification_scans(plan) == {
+        "ix_notification_profile_id_created_at"}
+
+
+@pytest.mark.asyncio
+async def test_count_unread_notifications_uses_partial_index(
+        seeded_profile_id):
+    plan = await explain(
+        NotificationRepo._count_unread_notifications_by_profile_id_query(
+            seeded_profile_id))
+    scans = await notification_scans(plan)
+    # the aggregation index shares the 'read = false' predicate
+    assert scans and scans <= {
+        "ix_notification_profile_id_unread",
+        "ix_notification_unread_aggregation_key"}
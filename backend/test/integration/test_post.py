@@ -107,3 +107,26 @@ async def test_post_privacy_on_another_profile_wall(ben, daisy, sumba, pumba):
            == 403
     assert (await pumba.conn.get(f"/posts/{friends_post_id}")).status_code \
            == 200
+
+
+@pytest.mark.asyncio
+async def test_get_posts_older_than(ben, daisy):
+    posts_ids = [(await ben.conn.post(
+        "/posts",
+        json={"content": str(i),
+              "privacy": "FRIENDS" if i % 2 else "PUBLIC"})).json()["id"]
+                 for i in range(5)][::-1]
+    first_page = (await daisy.conn.get(
+        "/posts", params={"wall_profile_id": ben.id, "limit": 2})).json()
+    second_page = (await daisy.conn.get(
+        "/posts", params={"wall_profile_id": ben.id,
+                          "older_than": first_page[-1]["createdAt"],
+                          "limit": 2})).json()
+    assert [post["id"] for post in first_page + second_page] \
+           == [posts_ids[0], posts_ids[2], posts_ids[4]]
+    assert (await ben.conn.delete(f"/posts/{posts_ids[2]}")).status_code \
+           == 204
+    posts = (await ben.conn.get(
+        "/posts", params={"wall_profile_id": ben.id, "limit": 10})).json()
+    assert [post["id"] for post in posts] \
+           == [posts_ids[0], posts_ids[1], posts_ids[3], posts_ids[4]]
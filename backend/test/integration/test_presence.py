@@ -0,0 +1,25 @@
+import datetime as dt
+from uuid import uuid4
+
+import pytest
+
+from common.injection import injector
+from config import cfg
+from pubsub.store import WebSocketsStore
+
+
+@pytest.mark.asyncio
+async def test_sorted_set_presence(monkeypatch):
+    monkeypatch.setattr(cfg, "presence_backend", "sorted_set")
+    store = injector.get(WebSocketsStore)
+    online_id, offline_id = str(uuid4()), str(uuid4())
+    await store.renew_online_status(online_id)
+    # renewals are written once per tick
+    assert await store.get_online_statuses([online_id]) == []
+    await store._flush_renewals()
+    assert await store.get_online_statuses([online_id, offline_id]) \
+           == [online_id]
+    last_seen = await store.get_last_seen([online_id, offline_id])
+    assert last_seen[offline_id] is None
+    assert dt.datetime.now(dt.timezone.utc) - last_seen[online_id] \
+           < dt.timedelta(seconds=WebSocketsStore.ONLINE_STATUS_EX)
@@ -29,6 +29,11 @@ export interface IsTypingMessage {
   chatGroupId: string;
 }
 
+export interface FriendPresenceMessage {
+  profileId: string;
+  online: boolean;
+}
+
 export interface ChatData {
   messages: ChatMessage[];
   isLoadingMessages: boolean;
@@ -16,6 +16,7 @@ import {
   ChatMessage,
   FriendChat,
   FriendChatStatus,
+  FriendPresenceMessage,
   IsTypingMessage,
   PrivateChat,
 } from "../model";
@@ -97,6 +98,16 @@ export class ChatStore {
       .subscribe((friendsIds: string[]) =>
         this._onlineFriendsIds$.next(friendsIds)
       );
+    this._ws
+      .listenTo("friend_presence")
+      .subscribe(({ profileId, online }: FriendPresenceMessage) => {
+        const friendsIds = this._onlineFriendsIds$.value.filter(
+          (id) => id !== profileId
+        );
+        this._onlineFriendsIds$.next(
+          online ? [...friendsIds, profileId] : friendsIds
+        );
+      });
 
     // update unread conversations count
     this._ws
@@ -62,6 +62,13 @@ export class WebSocketService {
     this._socket!.on("*", (msg: any) => {
       this._messages$.next({ event: msg.data[0], payload: msg.data[1] });
     });
+
+    // events sent on connect are batched into a single message
+    this._socket!.on("bootstrap", (events: [string, any][]) => {
+      for (const [event, payload] of events) {
+        this._messages$.next({ event, payload });
+      }
+    });
   }
 
   /**
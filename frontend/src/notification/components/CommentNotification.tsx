@@ -9,6 +9,7 @@ export interface CommentNotificationProps {
   postByUsername: string;
   postId: string;
   commentPreview: string;
+  actorsCount?: number;
   onVisit: () => any;
 }
 
@@ -20,6 +21,7 @@ const CommentNotification = ({
   postByUsername,
   postId,
   commentPreview,
+  actorsCount = 1,
   onVisit,
 }: CommentNotificationProps) => {
   return (
@@ -34,7 +36,9 @@ const CommentNotification = ({
         >
           {byUsername}
         </b>{" "}
-        has commented{" "}
+        {actorsCount > 1 &&
+          `and ${actorsCount - 1} ${actorsCount > 2 ? "others" : "other"} `}
+        {actorsCount > 1 ? "have" : "has"} commented{" "}
         {loggedUserId === postById ? "your" : `${postByUsername}'s`}{" "}
         <b
           className="is-clickable underline-on-hover"
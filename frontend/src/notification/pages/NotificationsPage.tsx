@@ -16,6 +16,7 @@ import NewFriendNotification from "../components/NewFriendNotification";
 import NewFriendshipRequestNotification from "../components/NewFriendshipRequestNotification";
 import PostNotification from "../components/PostNotification";
 import { NotificationType } from "../model";
+import { NotificationsService } from "../service";
 import { NotificationsPageStore } from "../stores/notificationsPage";
 
 const getNotificationComponent = (
@@ -57,6 +58,7 @@ const getNotificationComponent = (
 
 const NotificationsPage = () => {
   const store = useService(NotificationsPageStore);
+  const notificationsService = useService(NotificationsService);
   const user = useUser();
   const notifications = useObservable(store.notifications$);
   const isFetchingNotifications = useObservable(store.isFetchingNotifications$);
@@ -75,6 +77,13 @@ const NotificationsPage = () => {
     store.loadMoreNotifications();
   }, [user, profileId, store]);
 
+  useEffect(() => {
+    const sub = notificationsService.newNotifications$.subscribe(
+      (newNotifications) => store.addNewNotifications(newNotifications)
+    );
+    return () => sub.unsubscribe();
+  }, [notificationsService, store]);
+
   return (
     <div className="columns p-4">
       <div className="column is-one-quarter"></div>
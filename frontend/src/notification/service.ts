@@ -1,14 +1,17 @@
-import { BehaviorSubject, filter } from "rxjs";
+import { BehaviorSubject, filter, Subject } from "rxjs";
 import { singleton } from "tsyringe";
 import { BrowserTabsChannel } from "../common/channel";
 import { WebSocketService } from "../common/websocket";
+import { NotificationItem } from "./model";
 
 @singleton()
 export class NotificationsService {
   private _notificationsCount$ = new BehaviorSubject<number>(0);
+  private _newNotifications$ = new Subject<NotificationItem[]>();
 
   public readonly notificationsCount$ =
     this._notificationsCount$.asObservable();
+  public readonly newNotifications$ = this._newNotifications$.asObservable();
 
   constructor(
     private _ws: WebSocketService,
@@ -19,9 +22,12 @@ export class NotificationsService {
       .subscribe((count: number) => {
         this._notificationsCount$.next(count);
       });
-    this._ws.listenTo("new_unread_notification").subscribe((count: number) => {
-      this.alterNotificationsCount(count);
-    });
+    this._ws
+      .listenTo("new_unread_notification")
+      .subscribe((notifications: NotificationItem[]) => {
+        this.alterNotificationsCount(notifications.length);
+        this._newNotifications$.next(notifications);
+      });
     this._browserTabsChannel.messages$
       .pipe(filter((msg) => msg.event === "LOGOUT"))
       .subscribe(() => {
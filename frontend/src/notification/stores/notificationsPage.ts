@@ -58,6 +58,28 @@ export class NotificationsPageStore {
     }
   );
 
+  public addNewNotifications(notifications: NotificationItem[]) {
+    // pushed notifications are shown (and read) as they arrive
+    const ids = new Set(this._notifications$.value.map((n) => n.id));
+    const newNotifications = notifications.filter((n) => !ids.has(n.id));
+    if (!newNotifications.length) return;
+    this._notifications$.next([
+      ...newNotifications.reverse(),
+      ...this._notifications$.value,
+    ]);
+    notificationApi
+      .markNotificationsAs(
+        this._authService.user.id,
+        newNotifications.map((n) => n.id),
+        true
+      )
+      .then((updatedNotifications) => {
+        this._notificationsService.alterNotificationsCount(
+          -updatedNotifications.length
+        );
+      });
+  }
+
   public markNotificationsAsVisited(notificationIds: string[]) {
     notificationApi
       .markNotificationsAs(